@@ -1,12 +1,18 @@
 import click
 import torch
-from models import DFAOITNet, DFAOITNetConv, DFAOITNetShaderVersion
-from utils import load_weights_from_csharp, load_existing_weights
-from training import generate_consistency_data, simple_fine_tune, test_rgba_consistency
+from models import DFAOITNet, DFAOITNetConv, DFAOITNetConvNHWC, DFAOITNetShaderVersion
+from utils import (load_weights_from_csharp, load_existing_weights, adapt_state_dict, hidden_sizes, onnx_dynamic_axes,
+                   reshape_onnx, output_error_metrics)
+from training import simple_fine_tune, sharded_fine_tune, test_rgba_consistency, split_train_val
+from data_cache import DEFAULT_CACHE_DIR, load_consistency_data, load_consistency_dataset
+from shm_worker import BACKENDS, benchmark_shm_vs_pickle, make_frame_runner
+from output_formats import FORMATS
+from inference import (load_reference_model, load_onnx_session, dense_forward_torch,
+                       masked_forward_torch, masked_forward_onnx, benchmark_masked, benchmark_layout,
+                       benchmark_layout_onnx, benchmark_constant_folding)
 import os
 import subprocess
 import onnx
-from onnx import TensorShapeProto
 
 
 
@@ -28,14 +34,91 @@ def cli():
     5.python Main_cli_tool.py export-fp16 --pth DFAOITModel.pth --output DFAOITModel_fp16.onnx
 
     6.python Main_cli_tool.py compare-fp16 --pth default.pth --model_arch DFAOITNetConv
+
+    7.python Main_cli_tool.py bench-shm --backend torch --model default.pth --height 1080 --width 1920
+
+    8.python Main_cli_tool.py bench-masked --pth default.pth --coverages 0.05,0.25,0.5,1.0
+      python Main_cli_tool.py bench-masked --pth default.pth --mask_channel 9 --empty_value 1.0
+
+    9.python Main_cli_tool.py pipeline --spec pipeline_release.json --jobs 4
+
+    10.python Main_cli_tool.py tune --model default_conv_fp16_1080x1920.onnx --height 1080 --width 1920
+
+    11.python Main_cli_tool.py bench --save bench_baseline.json
+       python Main_cli_tool.py bench --compare bench_baseline.json --threshold 0.1
+
+    12.python Main_cli_tool.py bench-layout --pth default.pth --height 1080 --width 1920
+
+    13.python Main_cli_tool.py compress --pth default.pth --hidden1 24 --hidden2 12 --output default_small.pth
+
+    14.python Main_cli_tool.py train --samples 200000 --nproc 8
+       (host 0) python Main_cli_tool.py train --nproc 8 --nnodes 2 --node_rank 0 --master_addr 10.0.0.1 --master_port 29500
+       (host 1) python Main_cli_tool.py train --nproc 8 --nnodes 2 --node_rank 1 --master_addr 10.0.0.1 --master_port 29500
+       python Main_cli_tool.py ddp-scaling --workers 1,2,4,8 --samples 100000
+
+    15.python Main_cli_tool.py bench-fold --pth default.pth --constant 7,8,9
+
+    16.python Main_cli_tool.py verify --pth default.pth --onnx_dir release/ --batches 8 --report verify.json
+
+    17.python Main_cli_tool.py infer --model default.pth --input frames.npy --format rgb10a2 --output frames_rgb10a2.npy
+       python Main_cli_tool.py bench-formats --model default.pth --height 1080 --width 1920
     """
     pass
 
+def distributed_options(f):
+    """--nproc / multi-host options shared by train and finetune."""
+    options = [
+        click.option('--nproc', default=0, show_default=True, type=int, help='Data-parallel worker processes on this host (0: single-process training)'),
+        click.option('--nnodes', default=1, show_default=True, type=int, help='Number of hosts taking part in distributed training'),
+        click.option('--node_rank', default=0, show_default=True, type=int, help='Index of this host (0 saves the model)'),
+        click.option('--master_addr', default='127.0.0.1', show_default=True, type=str, help='Address of host 0'),
+        click.option('--master_port', default=None, type=int, help='Rendezvous port on host 0 (required with --nnodes > 1)'),
+        click.option('--batch_size', default=64, show_default=True, type=int, help='Per-worker batch size (distributed mode)'),
+        click.option('--lr', default=1e-3, show_default=True, type=float, help='Learning rate (distributed mode)'),
+        click.option('--threads_per_worker', default=1, show_default=True, type=int, help='torch threads per worker process'),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+
+def run_fine_tune(model, train_set, val_set, dist_opts):
+    """
+    sharded_fine_tune, or distributed_fine_tune_sets when --nproc > 0, on datasets from
+    load_consistency_dataset (read shard by shard). Returns False on hosts that must not save.
+    """
+    if not dist_opts['nproc']:
+        sharded_fine_tune(model, train_set, val_set)
+        return True
+    from ddp_training import distributed_fine_tune_sets
+
+    world = dist_opts['nproc'] * dist_opts['nnodes']
+    print(f"[ddp] {world} workers ({dist_opts['nnodes']} host(s) x {dist_opts['nproc']}), "
+          f"global batch {dist_opts['batch_size'] * world}")
+    history = distributed_fine_tune_sets(model, train_set, val_set,
+                                         nproc_per_node=dist_opts['nproc'], nnodes=dist_opts['nnodes'],
+                                         node_rank=dist_opts['node_rank'], master_addr=dist_opts['master_addr'],
+                                         master_port=dist_opts['master_port'], batch_size=dist_opts['batch_size'],
+                                         lr=dist_opts['lr'], threads_per_worker=dist_opts['threads_per_worker'])
+    if history is None:
+        print(f"[ddp] Host {dist_opts['node_rank']} finished; host 0 saves the model")
+        return False
+    best = min(history, key=lambda h: h['val'])
+    print(f"[ddp] {len(history)} epochs, best val={best['val']:.3e} (epoch {best['epoch']}), "
+          f"{sum(h['samples_per_s'] for h in history) / len(history):.0f} samples/s")
+    return True
+
+
 @cli.command()
 @click.option('--samples', default=15000, show_default=True, type=int, help='Number of training samples')
 @click.option('--output', default='DFAOITModel.pth', show_default=True, type=str, help='Save model path')
-
-def train(samples, output):
+@click.option('--seed', default=0, show_default=True, type=int, help='Seed of the generated consistency data')
+@click.option('--cache_dir', default=DEFAULT_CACHE_DIR, show_default=True, type=str, help='Generated dataset cache directory')
+@click.option('--no_cache', is_flag=True, default=False, help='Always regenerate the dataset, bypassing the cache')
+@click.option('--cache_max_gb', default=10.0, show_default=True, type=float, help='Dataset cache size cap (LRU eviction)')
+@click.option('--workers', default=0, show_default=True, type=int, help='Data generation processes (0: in-process)')
+@distributed_options
+def train(samples, output, seed, cache_dir, no_cache, cache_max_gb, workers, **dist_opts):
     
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     model = DFAOITNet().to(device)
@@ -60,14 +143,14 @@ def train(samples, output):
     except Exception as e:
         print(f"Fail: {e}")
         return
-    all_inputs, all_targets = generate_consistency_data(model, num_samples=samples)
-    train_size = int(0.8 * len(all_inputs))
-    train_inputs = all_inputs[:train_size]
-    train_targets = all_targets[:train_size]
-    val_inputs = all_inputs[train_size:]
-    val_targets = all_targets[train_size:]
-    print(f"Train set: {len(train_inputs)}，Validation set: {len(val_inputs)}")
-    history = simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets)
+    dataset = load_consistency_dataset(model, samples, seed=seed,
+                                       cache_dir=None if no_cache else cache_dir,
+                                       max_bytes=int(cache_max_gb * 1024 ** 3),
+                                       workers=workers)
+    train_set, val_set = dataset.split()
+    print(f"Train set: {len(train_set)}，Validation set: {len(val_set)}")
+    if not run_fine_tune(model, train_set, val_set, dist_opts):
+        return
     torch.save(model.state_dict(), output)
     
     print("Success，Save model to", output)
@@ -76,20 +159,27 @@ def train(samples, output):
 @click.option('--init', required=True, type=click.Path(exists=True), help='Initial Weight PTH File')
 @click.option('--samples', default=20000, show_default=True, type=int, help='Fine-tune the number of training samples')
 @click.option('--output', default='finetuned_DFAOITModel.pth', show_default=True, type=str, help='save path')
-def finetune(init, samples, output):
+@click.option('--seed', default=0, show_default=True, type=int, help='Seed of the generated consistency data')
+@click.option('--cache_dir', default=DEFAULT_CACHE_DIR, show_default=True, type=str, help='Generated dataset cache directory')
+@click.option('--no_cache', is_flag=True, default=False, help='Always regenerate the dataset, bypassing the cache')
+@click.option('--cache_max_gb', default=10.0, show_default=True, type=float, help='Dataset cache size cap (LRU eviction)')
+@click.option('--workers', default=0, show_default=True, type=int, help='Data generation processes (0: in-process)')
+@distributed_options
+def finetune(init, samples, output, seed, cache_dir, no_cache, cache_max_gb, workers, **dist_opts):
     
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = DFAOITNet().to(device)
-    model.load_state_dict(torch.load(init, map_location=device))
+    state_dict = torch.load(init, map_location=device)
+    model = DFAOITNet(*hidden_sizes(state_dict)).to(device)
+    model.load_state_dict(adapt_state_dict(state_dict, model))
     print(f"The initial weight file has been loaded.: {init}")
-    all_inputs, all_targets = generate_consistency_data(model, num_samples=samples)
-    train_size = int(0.8 * len(all_inputs))
-    train_inputs = all_inputs[:train_size]
-    train_targets = all_targets[:train_size]
-    val_inputs = all_inputs[train_size:]
-    val_targets = all_targets[train_size:]
-    print(f"Train set: {len(train_inputs)}，Validation set: {len(val_inputs)}")
-    history = simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets)
+    dataset = load_consistency_dataset(model, samples, seed=seed,
+                                       cache_dir=None if no_cache else cache_dir,
+                                       max_bytes=int(cache_max_gb * 1024 ** 3),
+                                       workers=workers)
+    train_set, val_set = dataset.split()
+    print(f"Train set: {len(train_set)}，Validation set: {len(val_set)}")
+    if not run_fine_tune(model, train_set, val_set, dist_opts):
+        return
     torch.save(model.state_dict(), output)
     print("Fine-tuning completed，save to", output)
 
@@ -98,7 +188,8 @@ def finetune(init, samples, output):
 @click.option('--output', default='DFAOITModel.onnx', show_default=True, type=str, help='ONNX 输出路径')
 @click.option('--dummy_h', default=16, show_default=True, type=int, help='导出用占位高度（仅构图用，实际推理支持动态）')
 @click.option('--dummy_w', default=16, show_default=True, type=int, help='导出用占位宽度（仅构图用，实际推理支持动态）')
-@click.option("--model_arch", type=click.Choice(["DFAOITNet", "DFAOITNetConv"]), default="DFAOITNet", help="Chose the model architecture to export")
+@click.option("--model_arch", type=click.Choice(["DFAOITNet", "DFAOITNetConv", "DFAOITNetConvNHWC"]), default="DFAOITNet",
+              help="Chose the model architecture to export (DFAOITNetConvNHWC: conv weights, NHWC input)")
 @click.option('--use_dynamic_axes', is_flag=True, default=False, help = "Allow dynamic model input size")
 def export(**kwargs):
 
@@ -111,23 +202,16 @@ def export(**kwargs):
     elif kwargs["model_arch"] == "DFAOITNetConv":
         model_class = DFAOITNetConv
         input_shape = (1, 10, kwargs['dummy_h'], kwargs['dummy_w'])
+    elif kwargs["model_arch"] == "DFAOITNetConvNHWC":
+        model_class = DFAOITNetConvNHWC
+        input_shape = (1, kwargs['dummy_h'], kwargs['dummy_w'], 10)
     else:
         raise NotImplementedError("Model architecture '%s' is no supported" % kwargs["model_arch"])
 
-    model = model_class().to(device)
-    
     try:
         state_dict = torch.load(kwargs['pth'], map_location=device)
-        
-        if kwargs["model_arch"] == "DFAOITNetConv":
-            if state_dict['layer1.weight'].shape != model.state_dict()['layer1.weight']:
-                state_dict['layer1.weight'] = state_dict['layer1.weight'][..., None, None]
-            if state_dict['layer2.weight'].shape != model.state_dict()['layer2.weight']:
-                state_dict['layer2.weight'] = state_dict['layer2.weight'][..., None, None]
-            if state_dict['layer3.weight'].shape != model.state_dict()['layer3.weight']:
-                state_dict['layer3.weight'] = state_dict['layer3.weight'][..., None, None]
-
-        model.load_state_dict(state_dict)
+        model = model_class(*hidden_sizes(state_dict)).to(device)
+        model.load_state_dict(adapt_state_dict(state_dict, model))
         
         print(f"Load weight success: {kwargs['pth']}")
     except Exception as e:
@@ -153,10 +237,8 @@ def export(**kwargs):
 
     
     try:
-        dynamic_axes = {
-                'input':  {0: 'N', 2: 'H', 3: 'W'},   # NHWC
-                'output': {0: 'N', 2: 'H', 3: 'W'}
-            } if kwargs['use_dynamic_axes'] else None
+        layout = 'NCHW' if kwargs["model_arch"] == "DFAOITNetConv" else 'NHWC'
+        dynamic_axes = onnx_dynamic_axes(layout) if kwargs['use_dynamic_axes'] else None
         torch.onnx.export(
             model,
             dummy_input,
@@ -179,7 +261,8 @@ def export(**kwargs):
 @click.option('--output', default='DFAOITModel_fp16.onnx', show_default=True, type=str, help='FP16 ONNX 输出路径')
 @click.option('--dummy_h', default=16, show_default=True, type=int, help='导出用占位高度（仅构图用，实际推理支持动态）')
 @click.option('--dummy_w', default=16, show_default=True, type=int, help='导出用占位宽度（仅构图用，实际推理支持动态）')
-@click.option("--model_arch", type=click.Choice(["DFAOITNet", "DFAOITNetConv"]), default="DFAOITNet", help="选择模型结构")
+@click.option("--model_arch", type=click.Choice(["DFAOITNet", "DFAOITNetConv", "DFAOITNetConvNHWC"]), default="DFAOITNet",
+              help="选择模型结构（DFAOITNetConvNHWC：卷积权重 + NHWC 输入）")
 @click.option('--use_dynamic_axes', is_flag=True, default=False, help="允许运行时动态分辨率")
 def export_fp16(**kwargs):
     """
@@ -197,27 +280,18 @@ def export_fp16(**kwargs):
     elif kwargs["model_arch"] == "DFAOITNetConv":
         model_class = DFAOITNetConv
         input_shape = (1, 10, kwargs['dummy_h'], kwargs['dummy_w'])   # NCHW
+    elif kwargs["model_arch"] == "DFAOITNetConvNHWC":
+        model_class = DFAOITNetConvNHWC
+        input_shape = (1, kwargs['dummy_h'], kwargs['dummy_w'], 10)   # NHWC
     else:
         raise NotImplementedError("Model architecture '%s' is not supported" % kwargs["model_arch"])
 
-    model = model_class().to(device)
-
-    
-    # 2. load FP32 weights
+    # 2. load FP32 weights（隐藏层大小取自 checkpoint）
   
     try:
         state_dict = torch.load(kwargs['pth'], map_location=device)
-
-       
-        if kwargs["model_arch"] == "DFAOITNetConv":
-            if state_dict['layer1.weight'].shape != model.state_dict()['layer1.weight'].shape:
-                state_dict['layer1.weight'] = state_dict['layer1.weight'][..., None, None]
-            if state_dict['layer2.weight'].shape != model.state_dict()['layer2.weight'].shape:
-                state_dict['layer2.weight'] = state_dict['layer2.weight'][..., None, None]
-            if state_dict['layer3.weight'].shape != model.state_dict()['layer3.weight'].shape:
-                state_dict['layer3.weight'] = state_dict['layer3.weight'][..., None, None]
-
-        model.load_state_dict(state_dict)
+        model = model_class(*hidden_sizes(state_dict)).to(device)
+        model.load_state_dict(adapt_state_dict(state_dict, model))
         print(f"[export_fp16] Load FP32 weight success: {kwargs['pth']}")
     except Exception as e:
         print(f"[export_fp16] Load weight failed: {e}")
@@ -255,10 +329,8 @@ def export_fp16(**kwargs):
     # 6. 动态输入设置
    
     try:
-        dynamic_axes = {
-            'input':  {0: 'N', 2: 'H', 3: 'W'},
-            'output': {0: 'N', 2: 'H', 3: 'W'}
-        } if kwargs['use_dynamic_axes'] else None
+        layout = 'NCHW' if kwargs["model_arch"] == "DFAOITNetConv" else 'NHWC'
+        dynamic_axes = onnx_dynamic_axes(layout) if kwargs['use_dynamic_axes'] else None
 
         
     # 7. export to FP16 ONNX
@@ -301,7 +373,6 @@ def compare_fp16(pth, dummy_h, dummy_w, model_arch, input_npy):
         – Compute the metrics: MAE, Max Absolute Difference, MSE, and PSNR.
     """
     import numpy as np
-    import math
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
@@ -316,19 +387,10 @@ def compare_fp16(pth, dummy_h, dummy_w, model_arch, input_npy):
         raise NotImplementedError("Model architecture '%s' is not supported" % model_arch)
 
     # 2. 构建 FP32 模型并加载权重
-    model_fp32 = model_class().to(device)
     try:
         state_dict = torch.load(pth, map_location=device)
-
-        if model_arch == "DFAOITNetConv":
-            
-            if state_dict['layer1.weight'].shape != model_fp32.state_dict()['layer1.weight'].shape:
-                state_dict['layer1.weight'] = state_dict['layer1.weight'][..., None, None]
-            if state_dict['layer2.weight'].shape != model_fp32.state_dict()['layer2.weight'].shape:
-                state_dict['layer2.weight'] = state_dict['layer2.weight'][..., None, None]
-            if state_dict['layer3.weight'].shape != model_fp32.state_dict()['layer3.weight'].shape:
-                state_dict['layer3.weight'] = state_dict['layer3.weight'][..., None, None]
-
+        model_fp32 = model_class(*hidden_sizes(state_dict)).to(device)
+        state_dict = adapt_state_dict(state_dict, model_fp32)
         model_fp32.load_state_dict(state_dict)
         print(f"[compare_fp16] Load FP32 weight success: {pth}")
     except Exception as e:
@@ -338,7 +400,7 @@ def compare_fp16(pth, dummy_h, dummy_w, model_arch, input_npy):
     model_fp32.eval()
 
     # 3. 构建 FP16 模型：同一权重，再 half()
-    model_fp16 = model_class().to(device)
+    model_fp16 = model_class(*hidden_sizes(state_dict)).to(device)
     model_fp16.load_state_dict(state_dict)  
     model_fp16.eval()
     model_fp16.half()  # 所有参数 -> FP16
@@ -361,30 +423,19 @@ def compare_fp16(pth, dummy_h, dummy_w, model_arch, input_npy):
         print(f"[compare_fp16] Forward inference failed: {e}")
         return
 
-    # 6. 转为 numpy 做误差统计
-    y32_np = y32.detach().cpu().numpy().astype(np.float32)
-    y16_np = y16.detach().cpu().numpy().astype(np.float32)
-
-    if y32_np.shape != y16_np.shape:
-        print(f"[compare_fp16] Shape mismatch: y32 {y32_np.shape} vs y16 {y16_np.shape}")
-        return
-
-    diff = y32_np - y16_np
-    mae = float(np.mean(np.abs(diff)))
-    max_abs = float(np.max(np.abs(diff)))
-    mse = float(np.mean(diff ** 2))
-
+    # 6. 误差统计
     # if output is [0,1],peak=1.0 ；if 0~255， peak = 255
-    peak = 1.0
-    #peak = 255.0
-    psnr = 10.0 * math.log10((peak ** 2) / (mse + 1e-12))
+    try:
+        metrics = output_error_metrics(y32, y16, peak=1.0)
+    except ValueError as e:
+        print(f"[compare_fp16] {e}")
+        return
 
-    
-    print("Output shape:", y32_np.shape)
-    print(f"MAE:          {mae:.8f}")
-    print(f"Max Abs Diff: {max_abs:.8f}")
-    print(f"MSE:          {mse:.10f}")
-    print(f"PSNR:         {psnr:.2f} dB")
+    print("Output shape:", tuple(y32.shape))
+    print(f"MAE:          {metrics['mae']:.8f}")
+    print(f"Max Abs Diff: {metrics['max_abs']:.8f}")
+    print(f"MSE:          {metrics['mse']:.10f}")
+    print(f"PSNR:         {metrics['psnr']:.2f} dB")
    
 
 
@@ -510,35 +561,11 @@ def reshape(input, height, width, output):
         model = onnx.load(input)
         print(f"Loaded ONNX model: {input}")
 
-        # ---- input: [1, 10, H, W] ----
-        in_tensor = model.graph.input[0]
-        dim_in = in_tensor.type.tensor_type.shape.dim
-        dim_in.clear()
-        dim_in.extend([
-            TensorShapeProto.Dimension(dim_value=1),         # N
-            TensorShapeProto.Dimension(dim_value=10),        # C=10
-            TensorShapeProto.Dimension(dim_value=height),    # H
-            TensorShapeProto.Dimension(dim_value=width),     # W
-        ])
-
-        # ---- output: [1, 3, H, W] ----
-        out_tensor = model.graph.output[0]
-        dim_out = out_tensor.type.tensor_type.shape.dim
-        dim_out.clear()
-        dim_out.extend([
-            TensorShapeProto.Dimension(dim_value=1),         # N
-            TensorShapeProto.Dimension(dim_value=3),         # C=3
-            TensorShapeProto.Dimension(dim_value=height),    # H
-            TensorShapeProto.Dimension(dim_value=width),     # W
-        ])
-
-        # 如果有多个 input，一并改成 NCHW 的 H、W
+        reshape_onnx(model, height, width)
         for t in model.graph.input:
             shape = t.type.tensor_type.shape
             if len(shape.dim) == 4:
                 # NCHW: 0=N, 1=C, 2=H, 3=W
-                shape.dim[2].dim_value = height
-                shape.dim[3].dim_value = width
                 print(
                     f"Updated {t.name} → [N,C,H,W]=["
                     f"{shape.dim[0].dim_value or 1},"
@@ -575,5 +602,539 @@ def create_default_ckpt(**kwargs):
     torch.save(model.state_dict(), kwargs["ckpt_path"])
 
 
+@cli.command()
+@click.option('--backend', type=click.Choice(BACKENDS), default='torch', show_default=True, help='Inference path used by the worker')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=None, help='.pth (torch/numpy) or NHWC .onnx (onnx); default: shader weights')
+@click.option('--height', default=1080, show_default=True, type=int, help='Frame height')
+@click.option('--width', default=1920, show_default=True, type=int, help='Frame width')
+@click.option('--frames', default=20, show_default=True, type=int, help='Number of timed frames')
+@click.option('--depth', default=2, show_default=True, type=int, help='Frames in flight (ring slots)')
+@click.option('--threads', default=None, type=int, help='Intra-op threads in the worker process')
+@click.option('--format', 'out_format', type=click.Choice(list(FORMATS)), default='fp32', show_default=True, help='Output format written by the worker')
+def bench_shm(backend, model_path, height, width, frames, depth, threads, out_format):
+    """
+    Compare shared-memory frame exchange against pickling frames through queues.
+    """
+    res = benchmark_shm_vs_pickle(backend, model_path, height, width, frames, depth, threads, out_format=out_format)
+    print(f"Frame: [{height},{width},10] -> [{height},{width},3] {out_format}, backend={backend}")
+    print(f"pickle: {res['pickle']['fps']:.2f} fps ({res['pickle']['seconds']:.3f}s)")
+    print(f"shm:    {res['shm']['fps']:.2f} fps ({res['shm']['seconds']:.3f}s)")
+    print(f"Speedup: {res['speedup']:.2f}x")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='PyTorch weights (default: shader weights)')
+@click.option('--onnx', 'onnx_path', type=click.Path(exists=True), default=None, help='Benchmark this ONNX model (dynamic H/W) instead of PyTorch')
+@click.option('--height', default=1080, show_default=True, type=int, help='Frame height')
+@click.option('--width', default=1920, show_default=True, type=int, help='Frame width')
+@click.option('--coverages', default='0.01,0.05,0.1,0.25,0.5,0.75,1.0', show_default=True, type=str, help='Comma-separated covered-pixel ratios')
+@click.option('--repeats', default=5, show_default=True, type=int, help='Timed runs per setting (best is reported)')
+@click.option('--mask_channel', default=None, type=click.IntRange(0, 9), help='Derive the mask from this input channel (e.g. accumulated alpha) instead of passing a random mask')
+@click.option('--empty_value', default=1.0, show_default=True, type=float, help='Value of --mask_channel at uncovered pixels')
+def bench_masked(pth, onnx_path, height, width, coverages, repeats, mask_channel, empty_value):
+    """
+    Dense vs alpha-coverage masked inference: speedup as a function of coverage.
+    """
+    import numpy as np
+
+    coverages = [float(c) for c in coverages.split(',') if c.strip()]
+    if onnx_path is not None:
+        session = load_onnx_session(onnx_path)
+        inp = session.get_inputs()[0]
+        nchw = inp.shape[1] == 10
+        in_dtype = np.float16 if inp.type == 'tensor(float16)' else np.float32
+
+        def run_dense(x):
+            feed = x.transpose(2, 0, 1)[None] if nchw else x[None]
+            y = session.run(None, {inp.name: np.ascontiguousarray(feed, dtype=in_dtype)})[0][0]
+            return y.transpose(1, 2, 0) if nchw else y
+
+        def run_masked(x, mask):
+            return masked_forward_onnx(session, x, mask, mask_channel=mask_channel, empty_value=empty_value)
+        print(f"[bench_masked] ONNX model: {onnx_path}")
+    else:
+        model = load_reference_model(pth)
+
+        def run_dense(x):
+            return dense_forward_torch(model, torch.from_numpy(x)).numpy()
+
+        def run_masked(x, mask):
+            mask = None if mask is None else torch.from_numpy(mask)
+            return masked_forward_torch(model, torch.from_numpy(x), mask,
+                                        mask_channel=mask_channel, empty_value=empty_value).numpy()
+        print(f"[bench_masked] PyTorch model: {type(model).__name__} ({pth or 'shader weights'})")
+
+    try:
+        results = benchmark_masked(run_dense, run_masked, height, width, coverages, repeats,
+                                   mask_channel=mask_channel, empty_value=empty_value)
+    except Exception as e:
+        print(f"[bench_masked] Benchmark failed: {e}")
+        return
+
+    source = 'random mask' if mask_channel is None else f"mask from channel {mask_channel} (empty = {empty_value})"
+    print(f"Frame: {height}x{width}, {source}")
+    print(f"{'coverage':>9} {'dense ms':>10} {'masked ms':>10} {'speedup':>8} {'max diff':>10}")
+    for r in results:
+        print(f"{r['coverage']:>9.2%} {r['dense_ms']:>10.2f} {r['masked_ms']:>10.2f} "
+              f"{r['speedup']:>7.2f}x {r['max_diff']:>10.2e}")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='DFAOITNet / DFAOITNetConv weights (default: shader weights)')
+@click.option('--height', default=1080, show_default=True, type=int, help='Frame height')
+@click.option('--width', default=1920, show_default=True, type=int, help='Frame width')
+@click.option('--repeats', default=5, show_default=True, type=int, help='Timed runs per path (best is reported)')
+@click.option('--onnx', 'onnx_paths', multiple=True, type=click.Path(exists=True), help='ONNX export(s) (NHWC and / or NCHW) to also route the NHWC frame to; repeatable')
+def bench_layout(pth, height, width, repeats, onnx_paths):
+    """
+    NHWC frame into DFAOITNetConv: permute().contiguous() copy vs channels_last execution,
+    and with --onnx, per-frame transpose vs routing to the export whose layout matches.
+    """
+    from pipeline import default_model
+
+    source = load_reference_model(pth) if pth else default_model()  # shader weights as DFAOITNet
+    model = DFAOITNetConv().eval()
+    model.load_state_dict(adapt_state_dict(source.state_dict(), model))
+
+    try:
+        results = benchmark_layout(model, height, width, repeats)
+    except Exception as e:
+        print(f"[bench_layout] Benchmark failed: {e}")
+        return
+
+    base = results['permute_copy']['ms']
+    print(f"Frame: [1,{height},{width},10] NHWC")
+    print(f"{'path':<14} {'ms':>9} {'copy ms':>9} {'speedup':>8}")
+    for name, r in results.items():
+        print(f"{name:<14} {r['ms']:>9.2f} {r['copy_ms']:>9.2f} {base / r['ms']:>7.2f}x")
+
+    if onnx_paths:
+        try:
+            results = benchmark_layout_onnx([load_onnx_session(p) for p in onnx_paths], height, width, repeats)
+        except Exception as e:
+            print(f"[bench_layout] ONNX benchmark failed: {e}")
+            return
+        base = max(r['ms'] for r in results.values())
+        print(f"ONNX: {', '.join(os.path.basename(p) for p in onnx_paths)}")
+        for name, r in results.items():
+            print(f"{name:<14} {r['ms']:>9.2f} {r['copy_ms']:>9.2f} {base / r['ms']:>7.2f}x")
+
+@cli.command()
+@click.option('--spec', required=True, type=click.Path(exists=True), help='JSON pipeline spec')
+@click.option('--jobs', default=None, type=int, help='Stages run concurrently (default: CPU count)')
+@click.option('--force', is_flag=True, default=False, help='Re-run every stage even if its inputs are unchanged')
+def pipeline(spec, jobs, force):
+    """
+    Run create_default_ckpt / train / finetune / export / export_fp16 / reshape / compare_fp16
+    stages from one spec in a single process, keeping models in memory between stages.
+    """
+    from pipeline import load_spec, run_pipeline
+
+    try:
+        results = run_pipeline(load_spec(spec), jobs=jobs, force=force)
+    except ValueError as e:
+        print(f"[pipeline] Invalid spec: {e}")
+        raise SystemExit(2)
+
+    for name, (status, info) in results.items():
+        detail = info.get('error') or (f"{info['seconds']:.2f}s" if 'seconds' in info else '')
+        print(f"[pipeline] {status:<8} {name} {detail}")
+    if any(status in ('failed', 'blocked') for status, _ in results.values()):
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option('--model', 'onnx_path', required=True, type=click.Path(exists=True), help='Exported .onnx model')
+@click.option('--height', default=1080, show_default=True, type=int, help='Target height (ignored for fixed-shape models)')
+@click.option('--width', default=1920, show_default=True, type=int, help='Target width (ignored for fixed-shape models)')
+@click.option('--repeats', default=10, show_default=True, type=int, help='Timed warm runs per configuration')
+@click.option('--warmup', default=2, show_default=True, type=int, help='Untimed runs per configuration')
+@click.option('--max_threads', default=None, type=int, help='Upper bound of intra-op threads to try (default: CPU count)')
+def tune(onnx_path, height, width, repeats, warmup, max_threads):
+    """
+    Search ONNX Runtime session options for this model and save the best as a JSON sidecar
+    (model.ort.json), picked up automatically by every ONNX inference path of the tool.
+    """
+    from ort_tuning import tune as tune_session, sidecar_path, DEFAULT_CONFIG
+
+    try:
+        best, trials = tune_session(onnx_path, height, width, warmup, repeats, max_threads)
+    except Exception as e:
+        print(f"[tune] Tuning failed: {e}")
+        return
+
+    default_ms = next((ms for cfg, ms, _ in trials if cfg == DEFAULT_CONFIG), None)
+    best_ms = min(ms for _, ms, _ in trials)
+    print(f"[tune] {len(trials)} configurations tried")
+    for key, value in best.items():
+        print(f"  {key:<26} {value}")
+    if default_ms is not None:
+        print(f"[tune] default {default_ms:.3f} ms -> tuned {best_ms:.3f} ms ({default_ms / best_ms:.2f}x)")
+    print(f"[tune] Saved to {sidecar_path(onnx_path)}")
+
+
+@cli.command()
+@click.option('--models', default=None, type=str, help='Comma-separated model classes (default: all)')
+@click.option('--shapes', default=None, type=str, help='Comma-separated shapes: 16x16,531x1076,1080x1920,batch65536 (default: all)')
+@click.option('--dtypes', default=None, type=str, help='Comma-separated dtypes: fp32,fp16,bf16 (default: all)')
+@click.option('--warmup', default=3, show_default=True, type=int, help='Untimed runs per case')
+@click.option('--repeats', default=10, show_default=True, type=int, help='Timed runs per case')
+@click.option('--threads', default=None, type=int, help='torch intra-op threads (pin for comparable numbers)')
+@click.option('--save', 'save_path', default=None, type=str, help='Write results to this baseline file')
+@click.option('--compare', 'baseline_path', default=None, type=click.Path(exists=True), help='Compare against a stored baseline')
+@click.option('--threshold', default=0.10, show_default=True, type=float, help='Allowed throughput drop before failing (0.10 = 10%)')
+def bench(models, shapes, dtypes, warmup, repeats, threads, save_path, baseline_path, threshold):
+    """
+    CPU benchmark of the models.py forward paths (latency distribution, throughput, peak memory).
+    With --compare, exits with status 1 if any case regressed beyond --threshold.
+    """
+    from benchmark import MODELS, SHAPES, DTYPES, run_suite, save_results, load_results, compare_results
+
+    def parse(value, choices, what):
+        if value is None:
+            return None
+        items = [v.strip() for v in value.split(',') if v.strip()]
+        unknown = [v for v in items if v not in choices]
+        if unknown:
+            raise click.BadParameter(f"unknown {what} {unknown}, expected {list(choices)}")
+        return items
+
+    report = run_suite(parse(models, MODELS, 'models'), parse(shapes, SHAPES, 'shapes'),
+                       parse(dtypes, DTYPES, 'dtypes'), warmup, repeats, threads)
+
+    print(f"{'case':<42} {'p50 ms':>10} {'p90 ms':>10} {'Mpx/s':>9} {'peak MB':>9}")
+    for case, r in report['results'].items():
+        if 'error' in r:
+            print(f"{case:<42} {r['error']}")
+            continue
+        lat = r['latency_ms']
+        print(f"{case:<42} {lat['p50']:>10.3f} {lat['p90']:>10.3f} "
+              f"{r['throughput_px_s'] / 1e6:>9.2f} {r['peak_memory_bytes'] / 1024 ** 2:>9.1f}")
+
+    if save_path:
+        save_results(report, save_path)
+        print(f"[bench] Results saved to {save_path}")
+
+    if baseline_path:
+        baseline = load_results(baseline_path)
+        if baseline['meta'].get('threads') != report['meta']['threads']:
+            print(f"[bench] Warning: baseline used {baseline['meta'].get('threads')} threads, "
+                  f"this run {report['meta']['threads']}")
+        rows = compare_results(report, baseline, threshold)
+        regressions = [row for row in rows if row[4]]
+        for case, base, cur, ratio, regressed in rows:
+            if cur is None:
+                status = report['results'].get(case, {}).get('error', 'missing from this run')
+                print(f"{case:<42} {base / 1e6:>9.2f} -> FAILED ({status}) REGRESSION")
+                continue
+            flag = 'REGRESSION' if regressed else 'ok'
+            print(f"{case:<42} {base / 1e6:>9.2f} -> {cur / 1e6:>9.2f} Mpx/s ({ratio:>6.2%}) {flag}")
+        if regressions:
+            failed = sum(row[2] is None for row in regressions)
+            print(f"[bench] {len(regressions)} case(s) regressed by more than {threshold:.0%} "
+                  f"or failed ({failed} failed / missing)")
+            raise SystemExit(1)
+        print(f"[bench] No regression beyond {threshold:.0%} ({len(rows)} cases compared)")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='DFAOITNet weights to compress (default: shader weights)')
+@click.option('--output', default='DFAOITModel_compressed.pth', show_default=True, type=str, help='Compressed checkpoint path')
+@click.option('--onnx_output', default=None, type=str, help='Compressed ONNX path (default: next to --output)')
+@click.option('--hidden1', default=None, type=int, help='Layer 1 units to keep (default: drop dead / negligible units only)')
+@click.option('--hidden2', default=None, type=int, help='Layer 2 units to keep (default: drop dead / negligible units only)')
+@click.option('--tol', default=1e-4, show_default=True, type=float, help='Relative importance below which a unit counts as negligible')
+@click.option('--rank1', default=None, type=int, help='Factorize layer 1 to this rank (low-rank model)')
+@click.option('--rank2', default=None, type=int, help='Factorize layer 2 to this rank (low-rank model)')
+@click.option('--samples', default=20000, show_default=True, type=int, help='Consistency samples (statistics + recovery fine-tuning)')
+@click.option('--seed', default=0, show_default=True, type=int, help='Seed of the generated consistency data')
+@click.option('--cache_dir', default=DEFAULT_CACHE_DIR, show_default=True, type=str, help='Generated dataset cache directory')
+@click.option('--no_cache', is_flag=True, default=False, help='Always regenerate the dataset, bypassing the cache')
+@click.option('--no_finetune', is_flag=True, default=False, help='Skip recovery fine-tuning')
+@click.option('--height', default=1080, show_default=True, type=int, help='Frame height for the latency measurement')
+@click.option('--width', default=1920, show_default=True, type=int, help='Frame width for the latency measurement')
+def compress(pth, output, onnx_output, hidden1, hidden2, tol, rank1, rank2, samples, seed, cache_dir, no_cache,
+             no_finetune, height, width):
+    """
+    Prune hidden units (activation statistics) and optionally factorize layers, recover accuracy
+    with consistency fine-tuning, and export the smaller checkpoint + ONNX.
+    """
+    from compress import activation_stats, prune_units, factorize, compression_report
+    from pipeline import default_model
+    from utils import export_onnx
+
+    if pth:
+        state_dict = torch.load(pth, map_location='cpu')
+        reference = DFAOITNet(*hidden_sizes(state_dict))
+        reference.load_state_dict(adapt_state_dict(state_dict, reference))
+    else:
+        reference = default_model()
+    reference.eval()
+    print(f"[compress] Reference: {pth or 'shader weights'}")
+
+    all_inputs, all_targets = load_consistency_data(reference, samples, seed=seed,
+                                                    cache_dir=None if no_cache else cache_dir)
+    (train_inputs, train_targets), (val_inputs, val_targets) = split_train_val(all_inputs, all_targets)
+
+    stats = activation_stats(reference, train_inputs)
+    for name, st in stats.items():
+        dead = int((st['active'] == 0).sum())
+        negligible = int((st['importance'] <= tol * st['importance'].max()).sum())
+        print(f"[compress] {name}: {len(st['mean'])} units, {dead} never active, {negligible} negligible")
+
+    rows = [('reference', compression_report(reference, val_inputs, val_targets, height, width))]
+    model, _, _ = prune_units(reference, stats, hidden1, hidden2, tol)
+    if rank1 or rank2:
+        model = factorize(model, rank1, rank2)
+    rows.append(('compressed', compression_report(model, val_inputs, val_targets, height, width)))
+
+    if not no_finetune:
+        simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets)
+        rows.append(('fine-tuned', compression_report(model, val_inputs, val_targets, height, width)))
+
+    model = model.cpu().eval()
+    torch.save(model.state_dict(), output)
+    print(f"[compress] Checkpoint saved to {output}")
+    onnx_output = onnx_output or os.path.splitext(output)[0] + '.onnx'
+    try:
+        export_onnx(model, onnx_output, (1, 16, 16, 10), 'NHWC', use_dynamic_axes=True)
+        print(f"[compress] ONNX exported to {onnx_output}")
+    except Exception as e:
+        print(f"[compress] ONNX export failed: {e}")
+
+    print(f"{'stage':<11} {'hidden':>8} {'FLOPs/px':>9} {'params':>7} {'ms/frame':>9} {'MAE':>10} {'max':>10}")
+    for stage, r in rows:
+        print(f"{stage:<11} {'%dx%d' % r['hidden']:>8} {r['flops_per_pixel']:>9} {r['params']:>7} "
+              f"{r['latency_ms']:>9.2f} {r['mae']:>10.2e} {r['max_abs']:>10.2e}")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='Initial DFAOITNet weights (default: shader weights)')
+@click.option('--workers', 'worker_counts', default='1,2,4', show_default=True, type=str, help='Comma-separated worker counts to compare')
+@click.option('--samples', default=50000, show_default=True, type=int, help='Consistency samples')
+@click.option('--epochs', default=3, show_default=True, type=int, help='Epochs per worker count (the first is warm-up)')
+@click.option('--batch_size', default=64, show_default=True, type=int, help='Per-worker batch size')
+@click.option('--threads_per_worker', default=1, show_default=True, type=int, help='torch threads per worker process')
+@click.option('--seed', default=0, show_default=True, type=int, help='Seed of the generated consistency data')
+@click.option('--cache_dir', default=DEFAULT_CACHE_DIR, show_default=True, type=str, help='Generated dataset cache directory')
+def ddp_scaling(pth, worker_counts, samples, epochs, batch_size, threads_per_worker, seed, cache_dir):
+    """
+    Data-parallel training throughput (samples/s) against the number of worker processes on this host.
+    """
+    from ddp_training import scaling_report
+    from pipeline import default_model
+
+    if pth:
+        state_dict = torch.load(pth, map_location='cpu')
+        model = DFAOITNet(*hidden_sizes(state_dict))
+        model.load_state_dict(adapt_state_dict(state_dict, model))
+    else:
+        model = default_model()
+    counts = [int(c) for c in worker_counts.split(',') if c.strip()]
+    all_inputs, all_targets = load_consistency_data(model, samples, seed=seed, cache_dir=cache_dir)
+    (train_inputs, train_targets), (val_inputs, val_targets) = split_train_val(all_inputs, all_targets)
+
+    rows = scaling_report(model, train_inputs, train_targets, val_inputs, val_targets, counts, epochs,
+                          batch_size=batch_size, threads_per_worker=threads_per_worker)
+    print(f"[ddp_scaling] {len(train_inputs)} training samples, batch {batch_size}/worker, "
+          f"{threads_per_worker} thread(s)/worker")
+    print(f"{'workers':>7} {'samples/s':>11} {'speedup':>8} {'efficiency':>10} {'val loss':>10}")
+    for r in rows:
+        print(f"{r['workers']:>7} {r['samples_per_s']:>11.0f} {r['speedup']:>7.2f}x {r['efficiency']:>10.0%} {r['val']:>10.2e}")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='PyTorch weights (default: shader weights)')
+@click.option('--constant', default='7,8,9', show_default=True, type=str, help='Comma-separated channels held constant per frame')
+@click.option('--height', default=1080, show_default=True, type=int, help='Frame height')
+@click.option('--width', default=1920, show_default=True, type=int, help='Frame width')
+@click.option('--frames', default=4, show_default=True, type=int, help='Frames (one random constant set each)')
+@click.option('--repeats', default=3, show_default=True, type=int, help='Timed passes over the frames (best is reported)')
+@click.option('--max_varying', default=0, show_default=True, type=click.IntRange(0, 10), help='Fold only when at most this many channels vary (else run dense)')
+def bench_fold(pth, constant, height, width, frames, repeats, max_varying):
+    """
+    Fold per-frame constant input channels into layer1's bias: dense vs folded (declared / detected).
+    Detection is opt-in in ConstantFoldedRunner; it is timed here to show what it costs.
+    """
+    channels = tuple(int(c) for c in constant.split(',') if c.strip())
+    if any(not 0 <= c < 10 for c in channels):
+        raise click.BadParameter(f"channels must be in [0, 9], got {channels}")
+    model = load_reference_model(pth)
+    try:
+        r = benchmark_constant_folding(model, height, width, channels, frames, repeats, max_varying=max_varying)
+    except Exception as e:
+        print(f"[bench_fold] Benchmark failed: {e}")
+        return
+
+    print(f"Frame: [1,{height},{width},10], constant channels {list(channels)}, "
+          f"{'folded' if r['folded'] else f'dense (more than {max_varying} varying channel(s))'}")
+    print(f"dense:              {r['dense_ms']:.2f} ms")
+    print(f"runner (declared):  {r['declared_ms']:.2f} ms ({r['dense_ms'] / r['declared_ms']:.2f}x)")
+    print(f"runner (detect):    {r['detect_ms']:.2f} ms ({r['dense_ms'] / r['detect_ms']:.2f}x)")
+    print(f"max diff vs model:  {r['max_diff']:.2e}")
+    print(f"specialization cache: {r['hits']} hits, {r['misses']} misses")
+
+
+@cli.command()
+@click.option('--pth', type=click.Path(exists=True), default=None, help='Reference PyTorch weights (default: shader weights)')
+@click.option('--onnx_dir', required=True, type=click.Path(exists=True, file_okay=False), help='Directory of exported .onnx models')
+@click.option('--pattern', default='*.onnx', show_default=True, type=str, help='File name pattern inside --onnx_dir')
+@click.option('--inputs', 'input_npy', type=click.Path(exists=True), default=None, help='Optional real NHWC frames .npy ([M,H,W,10] or [H,W,10])')
+@click.option('--batches', default=8, show_default=True, type=int, help='Input batches per model')
+@click.option('--batch_size', default=None, type=int, help='Batch size for models with a dynamic batch dim (default: M of --inputs, else 1)')
+@click.option('--height', default=None, type=int, help='Height for models with dynamic H (default: H of --inputs, else 64)')
+@click.option('--width', default=None, type=int, help='Width for models with dynamic W (default: W of --inputs, else 64)')
+@click.option('--tol_fp32', default=1e-4, show_default=True, type=float, help='Max abs error allowed for fp32 models')
+@click.option('--tol_fp16', default=2e-2, show_default=True, type=float, help='Max abs error allowed for fp16 models')
+@click.option('--jobs', default=None, type=int, help='Models verified concurrently (default: min(4, CPU count))')
+@click.option('--seed', default=0, show_default=True, type=int, help='Seed of the random inputs')
+@click.option('--report', 'report_path', default=None, type=str, help='Write the per-model results as JSON')
+def verify(pth, onnx_dir, pattern, input_npy, batches, batch_size, height, width, tol_fp32, tol_fp16, jobs, seed,
+           report_path):
+    """
+    Check every exported ONNX model against the PyTorch weights (layout, precision, fixed shape
+    and sigmoid are read from each graph). Exit status: 0 all pass, 1 tolerance exceeded,
+    2 a model could not be loaded / run or no model was found.
+    """
+    import json
+    import numpy as np
+    from verify import verify_directory, exit_code
+
+    frames = np.load(input_npy) if input_npy else None
+    if frames is not None:
+        # dynamic dims follow the real frames unless given explicitly
+        m, h, w = frames.shape[:3] if frames.ndim == 4 else (1,) + frames.shape[:2]
+        batch_size, height, width = batch_size or m, height or h, width or w
+        print(f"[verify] Inputs: {m} frame(s) of {h}x{w} from {input_npy}")
+    batch_size, height, width = batch_size or 1, height or 64, width or 64
+    results = verify_directory(pth, onnx_dir, pattern, jobs=jobs, seed=seed, frames=frames,
+                               batches=batches, batch_size=batch_size, height=height, width=width,
+                               tolerance={'fp32': tol_fp32, 'fp16': tol_fp16})
+
+    print(f"[verify] Reference: {pth or 'shader weights'}, {len(results)} model(s) in {onnx_dir}")
+    print(f"{'model':<44} {'layout':<6} {'prec':<5} {'sig':<4} {'shape':<16} {'input':<6} {'MAE':>10} {'max':>10} "
+          f"{'torch ms':>9} {'ort ms':>9} status")
+    for r in results:
+        if r['status'] == 'error':
+            print(f"{r['model']:<44} ERROR {r['error']}")
+            continue
+        shape = 'x'.join(str(d) for d in r['shape']) + ('' if r['fixed'] else '*')
+        print(f"{r['model']:<44} {r['layout']:<6} {r['precision']:<5} {'yes' if r['sigmoid'] else 'no':<4} "
+              f"{shape:<16} {'real' if r['real_inputs'] else 'random':<6} {r['mae']:>10.2e} {r['max_abs']:>10.2e} {r['torch_ms']:>9.2f} {r['ort_ms']:>9.2f} "
+              f"{'PASS' if r['status'] == 'pass' else 'FAIL (> %.0e)' % r['tolerance']}")
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"[verify] Report saved to {report_path}")
+
+    code = exit_code(results)
+    counts = {s: sum(r['status'] == s for r in results) for s in ('pass', 'fail', 'error')}
+    print(f"[verify] {counts['pass']} passed, {counts['fail']} failed, {counts['error']} errors")
+    if code:
+        raise SystemExit(code)
+
+
+@cli.command()
+@click.option('--backend', type=click.Choice(BACKENDS), default='torch', show_default=True, help='Inference path')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=None, help='.pth (torch/numpy) or NHWC .onnx (onnx); default: shader weights')
+@click.option('--input', 'input_npy', required=True, type=click.Path(exists=True), help='NHWC frames .npy ([M,H,W,10] or [H,W,10])')
+@click.option('--format', 'out_format', type=click.Choice(list(FORMATS)), default='fp32', show_default=True, help='Output format')
+@click.option('--output', required=True, type=str, help='Output .npy (written through a memory map)')
+@click.option('--peak', default=1.0, show_default=True, type=float, help='Output value mapped to the largest integer code')
+@click.option('--alpha', default=1.0, show_default=True, type=float, help='Constant alpha of rgba8 / rgb10a2 outputs')
+@click.option('--check/--no_check', default=True, show_default=True, help='Report the error of the first frame against fp32')
+def infer(backend, model_path, input_npy, out_format, output, peak, alpha, check):
+    """
+    Run frames through the model and write the outputs in a compact format (fp16 / rgb8 / rgba8 /
+    rgb10a2) straight into a memory-mapped .npy; clamp / scale / pack is fused into the last stage.
+    """
+    import time
+    import numpy as np
+    from output_formats import QuantizedWriter, allocate_output, dequantize, bytes_per_pixel
+
+    # copy-on-write map: frames are read lazily and stay writable for torch.from_numpy
+    frames = np.load(input_npy, mmap_mode='c')
+    if frames.ndim == 3:
+        frames = frames[None]
+    if frames.ndim != 4 or frames.shape[-1] != 10:
+        raise click.BadParameter(f"expected [M,H,W,10] frames, got {frames.shape}", param_hint='--input')
+    if frames.dtype != np.float32:
+        frames = frames.astype(np.float32)
+    count, height, width = frames.shape[:3]
+
+    try:
+        run = make_frame_runner(backend, model_path)
+    except Exception as e:
+        print(f"[infer] Failed to load model: {e}")
+        return
+    writer = QuantizedWriter(out_format, peak, alpha)
+    rows = height if backend == 'onnx' else None
+    out = allocate_output(out_format, (count, height, width), output)
+    start = time.perf_counter()
+    try:
+        for i in range(count):
+            writer.forward(run, frames[i], out[i], rows)
+    except Exception as e:
+        print(f"[infer] Inference failed: {e}")
+        return
+    elapsed = time.perf_counter() - start
+    out.flush()
+
+    pixels = count * height * width
+    print(f"[infer] {count} frame(s) [{height},{width}] -> {output} ({out_format}, {out.shape}, {out.dtype})")
+    print(f"[infer] {elapsed * 1000.0 / count:.2f} ms/frame, {pixels * bytes_per_pixel(out_format) / 2**20:.1f} MiB "
+          f"written (fp32: {pixels * bytes_per_pixel('fp32') / 2**20:.1f} MiB)")
+    if check:
+        reference = allocate_output('fp32', (height, width))
+        run(frames[0], reference)
+        metrics = output_error_metrics(reference, dequantize(out_format, out[0], peak), peak)
+        clipped = float(np.mean((reference < 0) | (reference > peak))) if FORMATS[out_format][2] else 0.0
+        native = np.dtype(getattr(run, 'out_dtype', np.float32)).name
+        print(f"[infer] frame 0 vs model output ({native}): MAE={metrics['mae']:.3e} max={metrics['max_abs']:.3e} "
+              f"PSNR={metrics['psnr']:.2f} dB, clipped={clipped:.2%}")
+
+
+@cli.command()
+@click.option('--backend', type=click.Choice(BACKENDS), default='torch', show_default=True, help='Inference path')
+@click.option('--model', 'model_path', type=click.Path(exists=True), default=None, help='.pth (torch/numpy) or NHWC .onnx (onnx); default: shader weights')
+@click.option('--input', 'input_npy', type=click.Path(exists=True), default=None, help='Real NHWC frame .npy ([H,W,10] or first of [M,H,W,10]); default: random')
+@click.option('--height', default=1080, show_default=True, type=int, help='Random frame height')
+@click.option('--width', default=1920, show_default=True, type=int, help='Random frame width')
+@click.option('--formats', default=','.join(FORMATS), show_default=True, type=str, help='Comma-separated output formats')
+@click.option('--peak', default=1.0, show_default=True, type=float, help='Output value mapped to the largest integer code')
+@click.option('--repeats', default=3, show_default=True, type=int, help='Timed runs per format (best is reported)')
+def bench_formats(backend, model_path, input_npy, height, width, formats, peak, repeats):
+    """
+    Per output format: forward + write time, bytes per pixel and error against the model's own
+    output (fp32, or fp16 for fp16 ONNX exports).
+    """
+    import numpy as np
+    from output_formats import format_report
+
+    names = [f.strip() for f in formats.split(',') if f.strip()]
+    unknown = [f for f in names if f not in FORMATS]
+    if unknown:
+        raise click.BadParameter(f"unknown formats {unknown}, expected {list(FORMATS)}", param_hint='--formats')
+    if input_npy:
+        x = np.load(input_npy)
+        x = np.ascontiguousarray(x[0] if x.ndim == 4 else x, dtype=np.float32)
+    else:
+        x = np.random.default_rng(0).random((height, width, 10), dtype=np.float32)
+    try:
+        run = make_frame_runner(backend, model_path)
+        rows = format_report(run, x, names, peak, repeats, x.shape[0] if backend == 'onnx' else None)
+    except Exception as e:
+        print(f"[bench_formats] Benchmark failed: {e}")
+        return
+
+    native = np.dtype(getattr(run, 'out_dtype', np.float32)).name
+    print(f"Frame: [{x.shape[0]},{x.shape[1]},10], backend={backend}, model output={native}, peak={peak}")
+    print(f"{'format':<8} {'B/px':>5} {'ms':>9} {'MAE':>10} {'max':>10} {'PSNR':>8} {'clipped':>8}")
+    for r in rows:
+        print(f"{r['format']:<8} {r['bytes_per_pixel']:>5} {r['ms']:>9.2f} {r['mae']:>10.2e} {r['max_abs']:>10.2e} "
+              f"{r['psnr']:>8.2f} {r['clipped']:>8.2%}")
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,162 @@
+import json
+import time
+import platform
+import logging
+
+import numpy as np
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+from models import DFAOITNet, DFAOITNetConv, DFAOITNetShaderVersion
+
+logger = logging.getLogger(__name__)
+
+MODELS = {
+    'DFAOITNet': DFAOITNet,
+    'DFAOITNetConv': DFAOITNetConv,
+    'DFAOITNetShaderVersion': DFAOITNetShaderVersion,
+}
+
+# name -> (H, W) for frames, or an int N for a batched [N,10] pixel list
+SHAPES = {
+    '16x16': (16, 16),
+    '531x1076': (531, 1076),
+    '1080x1920': (1080, 1920),
+    'batch65536': 65536,
+}
+
+DTYPES = {
+    'fp32': torch.float32,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
+
+
+def make_input(model_name, shape_name, dtype, seed=0):
+    """Random input in the layout the model expects; returns (x, pixel count)."""
+    g = torch.Generator().manual_seed(seed)
+    shape = SHAPES[shape_name]
+    if isinstance(shape, int):
+        n = shape
+        dims = (n, 10, 1, 1) if model_name == 'DFAOITNetConv' else (n, 10)
+    else:
+        h, w = shape
+        n = h * w
+        dims = (1, 10, h, w) if model_name == 'DFAOITNetConv' else (1, h, w, 10)
+    return torch.rand(*dims, generator=g).to(dtype), n
+
+
+@torch.no_grad()
+def peak_memory_bytes(fn):
+    """
+    Peak CPU memory allocated by torch during one call of fn, from the profiler's
+    allocation / free events (allocations are attributed to the op that made them).
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    current = peak = 0
+    for e in sorted(prof.events(), key=lambda e: e.time_range.start):
+        current += e.self_cpu_memory_usage
+        peak = max(peak, current)
+    return int(peak)
+
+
+@torch.no_grad()
+def bench_case(model, x, pixels, warmup=3, repeats=10):
+    for _ in range(warmup):
+        model(x)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model(x)
+        times.append((time.perf_counter() - start) * 1000.0)
+    times = np.asarray(times)
+    p50 = float(np.percentile(times, 50))
+    return {
+        'latency_ms': {
+            'min': float(times.min()),
+            'mean': float(times.mean()),
+            'p50': p50,
+            'p90': float(np.percentile(times, 90)),
+            'p99': float(np.percentile(times, 99)),
+        },
+        'throughput_px_s': pixels / (p50 / 1000.0),
+        'peak_memory_bytes': peak_memory_bytes(lambda: model(x)),
+    }
+
+
+def run_suite(models=None, shapes=None, dtypes=None, warmup=3, repeats=10, threads=None):
+    """
+    Benchmark every (model, shape, dtype) combination on CPU.
+    Returns {'meta': {...}, 'results': {"model/shape/dtype": case result or {'error': ...}}}.
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    models, shapes, dtypes = list(models or MODELS), list(shapes or SHAPES), list(dtypes or DTYPES)
+    results = {}
+    for model_name in models:
+        for dtype_name in dtypes:
+            model = MODELS[model_name]().eval().to(DTYPES[dtype_name])
+            for shape_name in shapes:
+                case = f"{model_name}/{shape_name}/{dtype_name}"
+                try:
+                    x, pixels = make_input(model_name, shape_name, DTYPES[dtype_name])
+                    results[case] = bench_case(model, x, pixels, warmup, repeats)
+                    logger.info(f"{case}: p50={results[case]['latency_ms']['p50']:.3f} ms")
+                except Exception as e:  # e.g. a dtype without CPU kernels on this build
+                    results[case] = {'error': f"{type(e).__name__}: {e}"}
+                    logger.warning(f"{case}: {results[case]['error']}")
+    meta = {
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'warmup': warmup,
+        'repeats': repeats,
+        'models': models,
+        'shapes': shapes,
+        'dtypes': dtypes,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    return {'meta': meta, 'results': results}
+
+
+def save_results(report, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _selected(case, meta):
+    """Whether this run's model / shape / dtype selection includes the case (old reports: yes)."""
+    model_name, shape_name, dtype_name = case.split('/')
+    return (model_name in meta.get('models', [model_name]) and shape_name in meta.get('shapes', [shape_name])
+            and dtype_name in meta.get('dtypes', [dtype_name]))
+
+
+def compare_results(current, baseline, threshold=0.10):
+    """
+    Compare throughput case by case against the cases that passed in the baseline.
+    Returns a list of (case, baseline px/s, current px/s, ratio, regressed);
+    regressed = throughput dropped by more than `threshold` (0.10 = 10%).
+    A baseline case that now errors, or is missing although this run selected it, is a
+    regression with current px/s and ratio None.
+    """
+    rows = []
+    for case, base in baseline['results'].items():
+        if 'error' in base:
+            continue
+        cur = current['results'].get(case)
+        if cur is None and not _selected(case, current['meta']):
+            continue
+        if cur is None or 'error' in cur:
+            rows.append((case, base['throughput_px_s'], None, None, True))
+            continue
+        ratio = cur['throughput_px_s'] / base['throughput_px_s']
+        rows.append((case, base['throughput_px_s'], cur['throughput_px_s'], ratio, ratio < 1.0 - threshold))
+    return rows
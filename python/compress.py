@@ -0,0 +1,154 @@
+import time
+import logging
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models import DFAOITNet, DFAOITNetLowRank
+from utils import output_error_metrics
+
+logger = logging.getLogger(__name__)
+
+
+@torch.no_grad()
+def activation_stats(model, inputs, batch_size=65536):
+    """
+    Per hidden unit statistics of a DFAOITNet on inputs [N,10] (after ReLU):
+      mean, std, active (fraction of samples > 0) and
+      importance = std * ||outgoing weight column||, i.e. how much the next layer's
+      pre-activation moves if the unit is replaced by its mean.
+    Returns {'layer1': {...}, 'layer2': {...}} of [hidden] tensors.
+    """
+    model = model.eval()
+    acc = {}
+    for start in range(0, len(inputs), batch_size):
+        x = inputs[start:start + batch_size]
+        h1 = F.relu(model.layer1(x))
+        h2 = F.relu(model.layer2(h1))
+        for name, h in (('layer1', h1), ('layer2', h2)):
+            h = h.double()
+            s, sq, active = acc.get(name, (0.0, 0.0, 0.0))
+            acc[name] = (s + h.sum(0), sq + (h * h).sum(0), active + (h > 0).sum(0).double())
+
+    n = len(inputs)
+    next_weight = {'layer1': model.layer2.weight, 'layer2': model.layer3.weight}
+    stats = {}
+    for name, (s, sq, active) in acc.items():
+        mean = s / n
+        std = (sq / n - mean * mean).clamp_min(0).sqrt()
+        stats[name] = {
+            'mean': mean.float(),
+            'std': std.float(),
+            'active': (active / n).float(),
+            'importance': std.float() * next_weight[name].detach().float().norm(dim=0),
+        }
+    return stats
+
+
+def _select_units(importance, keep=None, tol=1e-4):
+    """Indices (ascending) of the `keep` most important units, or of units above tol * max importance."""
+    if keep is None:
+        keep = int((importance > tol * importance.max()).sum())
+    keep = max(1, min(keep, len(importance)))
+    return importance.argsort(descending=True)[:keep].sort().values
+
+
+@torch.no_grad()
+def prune_units(model, stats, hidden1=None, hidden2=None, tol=1e-4):
+    """
+    Physically smaller DFAOITNet keeping `hidden1` / `hidden2` units of layer1 / layer2
+    (default: every unit whose importance is above tol * max). Pruned units are replaced
+    by their mean activation, folded into the next layer's bias, so dead and constant units
+    are removed without changing the output.
+    Returns (model, kept layer1 indices, kept layer2 indices).
+    """
+    keep1 = _select_units(stats['layer1']['importance'], hidden1, tol)
+    keep2 = _select_units(stats['layer2']['importance'], hidden2, tol)
+    drop1 = torch.ones(model.layer1.out_features, dtype=torch.bool)
+    drop1[keep1] = False
+    drop2 = torch.ones(model.layer2.out_features, dtype=torch.bool)
+    drop2[keep2] = False
+
+    w1, b1 = model.layer1.weight.detach(), model.layer1.bias.detach()
+    w2, b2 = model.layer2.weight.detach(), model.layer2.bias.detach()
+    w3, b3 = model.layer3.weight.detach(), model.layer3.bias.detach()
+    # 剪掉的单元按均值折进下一层 bias
+    b2 = b2 + w2[:, drop1] @ stats['layer1']['mean'][drop1]
+    b3 = b3 + w3[:, drop2] @ stats['layer2']['mean'][drop2]
+
+    pruned = DFAOITNet(len(keep1), len(keep2))
+    pruned.layer1.weight.copy_(w1[keep1])
+    pruned.layer1.bias.copy_(b1[keep1])
+    pruned.layer2.weight.copy_(w2[keep2][:, keep1])
+    pruned.layer2.bias.copy_(b2[keep2])
+    pruned.layer3.weight.copy_(w3[:, keep2])
+    pruned.layer3.bias.copy_(b3)
+    logger.info(f"Pruned layer1 {len(drop1)} -> {len(keep1)}, layer2 {len(drop2)} -> {len(keep2)}")
+    return pruned.eval(), keep1, keep2
+
+
+@torch.no_grad()
+def factorize(model, rank1=None, rank2=None):
+    """
+    DFAOITNetLowRank with layer1 / layer2 replaced by their rank-r truncated SVD
+    (rank None keeps the layer dense). A rank only saves work when r * (in + out) < in * out.
+    """
+    hidden1, hidden2 = model.layer1.out_features, model.layer2.out_features
+    low_rank = DFAOITNetLowRank(hidden1, hidden2, rank1, rank2)
+    for name, rank in (('layer1', rank1), ('layer2', rank2), ('layer3', None)):
+        src, dst = getattr(model, name), getattr(low_rank, name)
+        if not rank:
+            dst.weight.copy_(src.weight)
+            dst.bias.copy_(src.bias)
+            continue
+        out_features, in_features = src.weight.shape
+        if rank * (in_features + out_features) >= in_features * out_features:
+            logger.warning(f"{name}: rank {rank} does not reduce FLOPs of a {out_features}x{in_features} layer")
+        u, s, vh = torch.linalg.svd(src.weight.detach().double(), full_matrices=False)
+        dst.up.weight.copy_((u[:, :rank] * s[:rank]).float())
+        dst.down.weight.copy_(vh[:rank].float())
+        dst.up.bias.copy_(src.bias)
+    return low_rank.eval()
+
+
+def flops_per_pixel(model):
+    """Multiply-add FLOPs (2 per MAC) plus bias adds of one pixel through every Linear / 1x1 Conv."""
+    total = 0
+    for m in model.modules():
+        if isinstance(m, (nn.Linear, nn.Conv2d)):
+            out_features, in_features = m.weight.shape[:2]
+            total += 2 * in_features * out_features + (out_features if m.bias is not None else 0)
+    return total
+
+
+def parameter_count(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+@torch.no_grad()
+def frame_latency_ms(model, height=1080, width=1920, repeats=5):
+    """Best-of-`repeats` latency of one NHWC frame on CPU."""
+    x = torch.rand(1, height, width, 10)
+    model(x)  # warm-up
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model(x)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+@torch.no_grad()
+def compression_report(model, inputs, targets, height=1080, width=1920, repeats=5):
+    """FLOPs / parameters / frame latency of `model` and its error against the reference targets."""
+    model = model.cpu().eval()
+    metrics = output_error_metrics(targets, model(inputs))
+    return {
+        'hidden': (model.layer1.out_features, model.layer2.out_features),
+        'flops_per_pixel': flops_per_pixel(model),
+        'params': parameter_count(model),
+        'latency_ms': frame_latency_ms(model, height, width, repeats),
+        'mae': metrics['mae'],
+        'max_abs': metrics['max_abs'],
+    }
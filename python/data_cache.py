@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from training import generate_consistency_data_parallel, run_generation_pool, TensorShards
+
+logger = logging.getLogger(__name__)
+
+# bump when the generation scheme changes, so stale entries are never reused
+_FORMAT_VERSION = 3
+_MANIFEST = 'manifest.json'
+
+DEFAULT_CACHE_DIR = os.environ.get('DFAOIT_DATASET_CACHE', os.path.join('.cache', 'consistency_data'))
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_SHARD_SIZE = 8192
+
+
+def dataset_key(reference_model, num_samples, spatial, H, W, seed, shard_size=DEFAULT_SHARD_SIZE):
+    """Hash of everything that determines a generated dataset: reference weights + generation params."""
+    h = hashlib.sha256()
+    for name, t in sorted(reference_model.state_dict().items()):
+        t = t.detach().cpu().contiguous()
+        h.update(f"{name}:{t.dtype}:{tuple(t.shape)}".encode())
+        h.update(t.view(-1).view(torch.uint8).numpy().tobytes())
+    params = dict(version=_FORMAT_VERSION, num_samples=num_samples, spatial=bool(spatial),
+                  H=H if spatial else None, W=W if spatial else None, seed=seed, shard_size=shard_size)
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return h.hexdigest()[:32]
+
+
+class ShardedConsistencyDataset(Dataset):
+    """
+    Read-only view of a cached dataset, optionally restricted to samples [start, stop).
+    Shards are memory-mapped .npy files (inputs_XXXXX.npy / targets_XXXXX.npy) opened
+    lazily, one at a time, on first access. Picklable (workers re-open the maps).
+    """
+    def __init__(self, directory, start=0, stop=None):
+        self.directory = directory
+        with open(os.path.join(directory, _MANIFEST), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.shard_sizes = self.manifest['shard_sizes']
+        self.offsets = np.cumsum([0] + self.shard_sizes)
+        self.start = start
+        self.stop = int(self.offsets[-1]) if stop is None else stop
+        self._open = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_open'] = {}
+        return state
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def num_shards(self):
+        return len(self.shard_sizes)
+
+    def shard(self, i):
+        """(inputs, targets) of the whole shard i as read-only memory-mapped arrays."""
+        if i not in self._open:
+            self._open[i] = (
+                np.load(os.path.join(self.directory, f'inputs_{i:05d}.npy'), mmap_mode='r'),
+                np.load(os.path.join(self.directory, f'targets_{i:05d}.npy'), mmap_mode='r'),
+            )
+        return self._open[i]
+
+    def _pieces(self, start, stop):
+        """(shard, a, b) for the parts of shards covering absolute samples [start, stop)."""
+        first = int(np.searchsorted(self.offsets, start, side='right')) - 1
+        for i in range(max(first, 0), self.num_shards()):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            if lo >= stop:
+                break
+            yield i, max(start, lo) - lo, min(stop, hi) - lo
+
+    def iter_shards(self):
+        """Memory-mapped (inputs, targets) per shard, clipped to this view's range."""
+        for i, a, b in self._pieces(self.start, self.stop):
+            inputs, targets = self.shard(i)
+            yield inputs[a:b], targets[a:b]
+
+    def view(self, start=0, stop=None):
+        """Samples [start, stop) of this view, as another view over the same shards."""
+        stop = len(self) if stop is None else stop
+        return ShardedConsistencyDataset(self.directory, self.start + start, self.start + stop)
+
+    def split(self, train_ratio=0.8):
+        """Same split as training.split_train_val, as two views over the same shards."""
+        mid = int(train_ratio * len(self))
+        return self.view(0, mid), self.view(mid)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        idx += self.start
+        i = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        inputs, targets = self.shard(i)
+        j = idx - self.offsets[i]
+        return torch.from_numpy(np.array(inputs[j])), torch.from_numpy(np.array(targets[j]))
+
+    def slice(self, start=0, stop=None):
+        """Samples [start, stop) of this view as (inputs, targets) tensors; only overlapping shards are read."""
+        stop = len(self) if stop is None else stop
+        xs, ys = [], []
+        for i, a, b in self._pieces(self.start + start, self.start + stop):
+            inputs, targets = self.shard(i)
+            xs.append(torch.from_numpy(np.array(inputs[a:b])))
+            ys.append(torch.from_numpy(np.array(targets[a:b])))
+        return torch.cat(xs), torch.cat(ys)
+
+    def tensors(self):
+        return self.slice(0, len(self))
+
+
+class DatasetCache:
+    """
+    On-disk cache of generated consistency datasets:
+      <cache_dir>/<key>/manifest.json + inputs_XXXXX.npy / targets_XXXXX.npy
+    The manifest mtime is the last-use time; when the directory grows beyond
+    max_bytes the least recently used entries are removed.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get_or_create(self, reference_model, num_samples, spatial=False, H=16, W=16, seed=0,
+                      shard_size=DEFAULT_SHARD_SIZE, workers=0):
+        """
+        Cached dataset for these parameters, generating it on a miss.
+        Shard i is generated from derive_seed(seed, i) by run_generation_pool, writing straight
+        into the preallocated shard files (workers=0: in this process), so the data is the
+        same as the uncached path's for the same seed.
+        """
+        key = dataset_key(reference_model, num_samples, spatial, H, W, seed, shard_size)
+        directory = self.entry_dir(key)
+        manifest = os.path.join(directory, _MANIFEST)
+
+        if os.path.exists(manifest):
+            os.utime(manifest)  # LRU touch
+            logger.info(f"Dataset cache hit: {directory}")
+            return ShardedConsistencyDataset(directory)
+
+        logger.info(f"Dataset cache miss, generating {num_samples} samples into {directory}")
+        tmp = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            shard_sizes = [min(shard_size, num_samples - start) for start in range(0, num_samples, shard_size)]
+            in_shape = (10, H, W) if spatial else (10,)
+            out_shape = (3, H, W) if spatial else (3,)
+            for i, n in enumerate(shard_sizes):
+                np.lib.format.open_memmap(os.path.join(tmp, f'inputs_{i:05d}.npy'), mode='w+',
+                                          dtype=np.float32, shape=(n, *in_shape)).flush()
+                np.lib.format.open_memmap(os.path.join(tmp, f'targets_{i:05d}.npy'), mode='w+',
+                                          dtype=np.float32, shape=(n, *out_shape)).flush()
+            run_generation_pool(reference_model, num_samples, tmp, spatial, H, W, seed,
+                                workers=workers, chunk_size=shard_size)
+
+            with open(os.path.join(tmp, _MANIFEST), 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'num_samples': num_samples, 'spatial': bool(spatial), 'H': H, 'W': W,
+                           'seed': seed, 'shard_size': shard_size, 'shard_sizes': shard_sizes,
+                           'created': time.time()}, f, indent=2)
+            # 原子发布：并发生成时以先完成者为准
+            try:
+                os.rename(tmp, directory)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        self.evict(keep=key)
+        return ShardedConsistencyDataset(directory)
+
+    def entries(self):
+        """[(key, last_used, size_bytes)] for all complete entries."""
+        result = []
+        for key in os.listdir(self.cache_dir):
+            manifest = os.path.join(self.entry_dir(key), _MANIFEST)
+            if not os.path.exists(manifest):
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(self.entry_dir(key)) if e.is_file())
+            result.append((key, os.path.getmtime(manifest), size))
+        return result
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self.entries(), key=lambda e: e[1])
+        total = sum(size for _, _, size in entries)
+        for key, _, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted cached dataset {key} ({size / 1024 ** 2:.1f} MB)")
+
+
+def load_consistency_dataset(reference_model, num_samples, spatial=False, H=16, W=16, seed=0,
+                             cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, workers=0,
+                             shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Generated consistency dataset with the shard interface (iter_shards / split / tensors):
+    a memory-mapped ShardedConsistencyDataset from the cache, or, with cache_dir=None,
+    TensorShards over freshly generated tensors. Both come from the same generator
+    (chunk i = derive_seed(seed, i), chunk size = shard_size), so the data is identical
+    with and without the cache and for any number of workers.
+    """
+    if cache_dir is None:
+        inputs, targets = generate_consistency_data_parallel(reference_model, num_samples, spatial, H, W, seed=seed,
+                                                             workers=workers, chunk_size=shard_size)
+        return TensorShards(inputs, targets, shard_size)
+    return DatasetCache(cache_dir, max_bytes).get_or_create(reference_model, num_samples, spatial, H, W, seed,
+                                                            shard_size=shard_size, workers=workers)
+
+
+def load_consistency_data(reference_model, num_samples, spatial=False, H=16, W=16, seed=0,
+                          cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, workers=0):
+    """
+    load_consistency_dataset as (inputs, targets) tensors, for callers that need the whole
+    set in memory (activation statistics, DDP shared memory). Training uses the dataset.
+    """
+    return load_consistency_dataset(reference_model, num_samples, spatial, H, W, seed,
+                                    cache_dir, max_bytes, workers).tensors()
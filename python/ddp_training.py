@@ -0,0 +1,199 @@
+import os
+import copy
+import time
+import socket
+import logging
+import tempfile
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+
+from models import DFAOITNet, DFAOITNetLowRank
+from training import TensorShards, as_shard_tensor
+from utils import model_config
+
+logger = logging.getLogger(__name__)
+
+# simple_fine_tune 的配置，batch 由 1 改为每个 worker 的 mini-batch
+DEFAULT_CONFIG = {
+    'lr': 1e-3,
+    'epochs': 50,
+    'patience': 10,
+    'batch_size': 64,          # per worker; the global batch is batch_size * world_size
+    'threads_per_worker': 1,
+    'seed': 0,
+}
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _ddp_worker(local_rank, node_rank, nproc_per_node, world_size, master_addr, master_port,
+                model_kwargs, state_dict, data, config, best_path, results):
+    """
+    One training process. Every rank sees the full dataset (shared-memory tensors or
+    memory-mapped shards) but only iterates its DistributedSampler part; gradients are
+    all-reduced by DDP after each step. Validation is split into contiguous per-rank
+    ranges read shard by shard. Rank 0 tracks the global validation loss, saves the best
+    checkpoint and decides when to stop; the decision is broadcast so all ranks leave
+    the loop together.
+    """
+    rank = node_rank * nproc_per_node + local_rank
+    torch.set_num_threads(config['threads_per_worker'])
+    dist.init_process_group('gloo', init_method=f'tcp://{master_addr}:{master_port}',
+                            rank=rank, world_size=world_size)
+    try:
+        low_rank = 'rank1' in model_kwargs or 'rank2' in model_kwargs
+        model = DFAOITNetLowRank(**model_kwargs) if low_rank else DFAOITNet(**model_kwargs)
+        model.load_state_dict(state_dict)
+        ddp_model = DistributedDataParallel(model)
+
+        train_set, val_set = data
+        # 默认补齐到等长分片，各 rank 的 step 数相同，all-reduce 不会卡住
+        sampler = DistributedSampler(train_set, num_replicas=world_size, rank=rank,
+                                     shuffle=True, seed=config['seed'])
+        loader = DataLoader(train_set, batch_size=config['batch_size'], sampler=sampler)
+        val_part = val_set.view(rank * len(val_set) // world_size, (rank + 1) * len(val_set) // world_size)
+
+        optimizer = optim.AdamW(ddp_model.parameters(), lr=config['lr'], weight_decay=1e-3)
+        scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.8, patience=5)
+
+        history, best_val, patience_counter = [], float('inf'), 0
+        stop = torch.zeros(1)
+        for epoch in range(config['epochs']):
+            sampler.set_epoch(epoch)
+            ddp_model.train()
+            start = time.perf_counter()
+            loss_sum, seen = 0.0, 0
+            for x, y in loader:
+                optimizer.zero_grad()
+                loss = F.mse_loss(ddp_model(x), y)
+                loss.backward()
+                optimizer.step()
+                loss_sum += loss.item() * len(x)
+                seen += len(x)
+            elapsed = time.perf_counter() - start
+
+            model.eval()
+            val_sq, val_elems = 0.0, 0
+            with torch.no_grad():
+                for inputs, targets in val_part.iter_shards():
+                    inputs, targets = as_shard_tensor(inputs, 'cpu'), as_shard_tensor(targets, 'cpu')
+                    val_sq += F.mse_loss(model(inputs), targets, reduction='sum').item()
+                    val_elems += targets.numel()
+            totals = torch.tensor([loss_sum, seen, val_sq, val_elems], dtype=torch.float64)
+            dist.all_reduce(totals)
+            train_loss = (totals[0] / totals[1]).item()
+            val_loss = (totals[2] / totals[3]).item()
+            scheduler.step(val_loss)
+
+            if rank == 0:
+                history.append({'epoch': epoch, 'train': train_loss, 'val': val_loss,
+                                'seconds': elapsed, 'samples_per_s': totals[1].item() / elapsed})
+                if val_loss < best_val:
+                    best_val, patience_counter = val_loss, 0
+                    torch.save(model.state_dict(), best_path)
+                else:
+                    patience_counter += 1
+                if epoch % 5 == 0:
+                    logger.info(f"[{epoch}] train={train_loss:.6f} val={val_loss:.6f} best={best_val:.6f} "
+                                f"({totals[1].item() / elapsed:.0f} samples/s)")
+                stop.fill_(float(patience_counter >= config['patience']))
+            dist.broadcast(stop, src=0)
+            if stop.item():
+                if rank == 0:
+                    logger.info(f"Early stopping at {epoch}")
+                break
+
+        if rank == 0:
+            results.put(history)
+    finally:
+        dist.destroy_process_group()
+
+
+def distributed_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets,
+                          nproc_per_node=2, nnodes=1, node_rank=0, master_addr='127.0.0.1', master_port=None,
+                          best_path='best_consistency_model.pth', **config):
+    """
+    Data-parallel counterpart of simple_fine_tune (CPU, gloo backend, inputs [N,10]).
+    The tensors are moved to shared memory; see distributed_fine_tune_sets for datasets.
+
+    Single host : distributed_fine_tune(model, ..., nproc_per_node=4)
+    Multi host  : run the same call on every host with the same nnodes / master_addr /
+                  master_port and node_rank = 0 .. nnodes-1. The data must be identical on
+                  all hosts (same --samples / --seed, see training.derive_seed).
+
+    config overrides DEFAULT_CONFIG (lr, epochs, patience, batch_size, threads_per_worker, seed).
+    On node 0 the best weights are loaded back into `model` and the per-epoch history
+    (train / val loss, samples/s) is returned; other nodes return None.
+    """
+    # 张量经 spawn 传给子进程时走共享内存，不会为每个 worker 复制一份
+    data = [t.float().contiguous().share_memory_() for t in (train_inputs, train_targets, val_inputs, val_targets)]
+    return distributed_fine_tune_sets(model, TensorShards(data[0], data[1]), TensorShards(data[2], data[3]),
+                                      nproc_per_node, nnodes, node_rank, master_addr, master_port, best_path, **config)
+
+
+def distributed_fine_tune_sets(model, train_set, val_set, nproc_per_node=2, nnodes=1, node_rank=0,
+                               master_addr='127.0.0.1', master_port=None,
+                               best_path='best_consistency_model.pth', **config):
+    """
+    distributed_fine_tune over datasets with the shard interface (training.TensorShards or
+    data_cache.ShardedConsistencyDataset). Cached datasets are passed to the workers by
+    directory and memory-mapped there, so nothing is concatenated or copied per worker.
+    """
+    config = dict(DEFAULT_CONFIG, **config)
+    unknown = set(config) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown config keys {sorted(unknown)}")
+    if master_port is None:
+        if nnodes > 1:
+            raise ValueError("master_port is required when training on more than one host")
+        master_port = free_port()
+
+    model = model.cpu()
+    model_kwargs = model_config(model.state_dict())
+    state_dict = {k: v.detach().clone() for k, v in model.state_dict().items()}
+    data = (train_set, val_set)
+    results = mp.get_context('spawn').SimpleQueue()
+
+    mp.spawn(_ddp_worker, nprocs=nproc_per_node, join=True,
+             args=(node_rank, nproc_per_node, nnodes * nproc_per_node, master_addr, master_port,
+                   model_kwargs, state_dict, data, config, best_path, results))
+
+    if node_rank != 0:
+        return None
+    history = results.get()
+    model.load_state_dict(torch.load(best_path, map_location='cpu'))
+    return history
+
+
+def scaling_report(model, train_inputs, train_targets, val_inputs, val_targets,
+                   worker_counts=(1, 2, 4), epochs=3, **config):
+    """
+    Train copies of `model` for a fixed number of epochs (no early stopping) with each
+    worker count on this host. Throughput is the median samples/s over the epochs after
+    the first. Returns [{'workers', 'samples_per_s', 'speedup', 'efficiency', 'val'}].
+    """
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in worker_counts:
+            history = distributed_fine_tune(copy.deepcopy(model), train_inputs, train_targets, val_inputs, val_targets,
+                                            nproc_per_node=workers, best_path=os.path.join(tmp, f'best_{workers}.pth'),
+                                            epochs=epochs, patience=epochs + 1, **config)
+            timed = sorted(h['samples_per_s'] for h in (history[1:] or history))
+            rows.append({'workers': workers, 'samples_per_s': timed[len(timed) // 2], 'val': history[-1]['val']})
+            logger.info(f"{workers} worker(s): {rows[-1]['samples_per_s']:.0f} samples/s")
+    base = rows[0]
+    for row in rows:
+        row['speedup'] = row['samples_per_s'] / base['samples_per_s']
+        row['efficiency'] = row['speedup'] * base['workers'] / row['workers']
+    return rows
@@ -0,0 +1,613 @@
+import copy
+import time
+from collections import OrderedDict
+import numpy as np
+import torch
+import torch.nn.functional as F
+import logging
+
+from models import DFAOITNet, DFAOITNetConv, DFAOITNetLowRank, DFAOITNetShaderVersion
+from utils import model_config
+
+logger = logging.getLogger(__name__)
+
+
+def load_reference_model(model_path=None):
+    """
+    Shader weights when model_path is None, otherwise a DFAOITNet / DFAOITNetConv / DFAOITNetLowRank
+    .pth (hidden sizes and ranks are read from the checkpoint).
+    """
+    if model_path is None:
+        return DFAOITNetShaderVersion().eval()
+    state_dict = torch.load(model_path, map_location='cpu')
+    config = model_config(state_dict)
+    if 'rank1' in config or 'rank2' in config:
+        model = DFAOITNetLowRank(**config)
+    elif state_dict['layer1.weight'].dim() == 4:
+        model = DFAOITNetConv(**config)
+    else:
+        model = DFAOITNet(**config)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+@torch.no_grad()
+def dense_forward_torch(model, x):
+    """Full-frame forward of an NHWC frame [H,W,10] for any model class; returns [H,W,3]."""
+    if isinstance(model, DFAOITNetConv):
+        return model(x.permute(2, 0, 1)[None])[0].permute(1, 2, 0)
+    return model(x[None])[0]
+
+
+def mlp_weights(model):
+    """
+    Extract the per-pixel MLP of any DFAOIT model as plain [out, in] matrices.
+      DFAOITNet              : nn.Linear weights
+      DFAOITNetConv          : 1x1 Conv2d weights, squeezed to [out, in]
+      DFAOITNetShaderVersion : W1/W2/W3 stored as [in, out], transposed
+    Returns ([(W1, b1), (W2, b2), (W3, b3)], apply_sigmoid)
+    """
+    with torch.no_grad():
+        if isinstance(model, DFAOITNetShaderVersion):
+            layers = [(model.W1.t(), model.b1), (model.W2.t(), model.b2), (model.W3.t(), model.b3)]
+            return [(w.contiguous(), b) for w, b in layers], True
+
+        layers = []
+        for layer in (model.layer1, model.layer2, model.layer3):
+            w = layer.weight
+            if w.dim() == 4:  # Conv2d 1x1: [out, in, 1, 1]
+                w = w.flatten(1)
+            layers.append((w.contiguous(), layer.bias))
+        return layers, False
+
+
+def numpy_weights(model):
+    """Same as mlp_weights, but as fp32 NumPy arrays pre-transposed to [in, out] for x @ W."""
+    layers, sigmoid = mlp_weights(model)
+    return [(w.detach().cpu().float().numpy().T.copy(), b.detach().cpu().float().numpy().copy())
+            for w, b in layers], sigmoid
+
+
+@torch.no_grad()
+def forward_into_torch(layers, sigmoid, x, out, chunk_pixels=1 << 14):
+    """
+    Run the MLP on x ([..., 10], contiguous) and write the result straight into out ([..., 3]).
+    Pixels are processed in chunks of `chunk_pixels` through two reused hidden buffers, so the
+    activations stay in cache (several times faster than one full-frame pass on large frames);
+    the last layer is an addmm with out=, so no intermediate output tensor is allocated.
+    """
+    (w1, b1), (w2, b2), (w3, b3) = layers
+    flat = x.reshape(-1, x.size(-1))
+    flat_out = out.view(-1, out.size(-1))
+    rows = min(len(flat), chunk_pixels)
+    h1, h2 = flat.new_empty(rows, w1.size(0)), flat.new_empty(rows, w2.size(0))
+    for start in range(0, len(flat), chunk_pixels):
+        xs = flat[start:start + chunk_pixels]
+        n = len(xs)
+        h = torch.addmm(b1, xs, w1.t(), out=h1[:n]).relu_()
+        h = torch.addmm(b2, h, w2.t(), out=h2[:n]).relu_()
+        torch.addmm(b3, h, w3.t(), out=flat_out[start:start + n])
+    if sigmoid:
+        flat_out.sigmoid_()
+    return out
+
+
+def forward_into_numpy(layers, sigmoid, x, out):
+    """NumPy version of forward_into_torch. x: [..., 10] fp32, out: [..., 3] fp32."""
+    (w1, b1), (w2, b2), (w3, b3) = layers
+    h = x.reshape(-1, x.shape[-1])
+    h = h @ w1
+    h += b1
+    np.maximum(h, 0, out=h)
+    h = h @ w2
+    h += b2
+    np.maximum(h, 0, out=h)
+    flat_out = out.reshape(-1, out.shape[-1])
+    np.matmul(h, w3, out=flat_out)
+    flat_out += b3
+    if sigmoid:
+        # sigmoid(x) = 1 / (1 + exp(-x))，全部原地完成
+        np.negative(flat_out, out=flat_out)
+        np.exp(flat_out, out=flat_out)
+        flat_out += 1.0
+        np.reciprocal(flat_out, out=flat_out)
+    return out
+
+
+def load_onnx_session(onnx_path):
+    """Create a CPU ONNX Runtime session for an exported DFAOIT model (tuned options if a sidecar exists)."""
+    from ort_tuning import create_session
+    return create_session(onnx_path)
+
+
+def forward_into_onnx(session, x, out):
+    """
+    Run an ONNX session with IO binding: the input is read from x's buffer and the output is
+    written into out's buffer directly (both must be C-contiguous and match the graph shapes).
+    """
+    binding = session.io_binding()
+    inp = session.get_inputs()[0]
+    outp = session.get_outputs()[0]
+    binding.bind_input(inp.name, 'cpu', 0, x.dtype.type, list(x.shape), x.ctypes.data)
+    binding.bind_output(outp.name, 'cpu', 0, out.dtype.type, list(out.shape), out.ctypes.data)
+    session.run_with_iobinding(binding)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Alpha-coverage masked inference
+#   Pixels without transparent coverage are fully determined by the background
+#   (auto_mix: final = rgb + acc_a * bg), so the MLP only needs to run on the
+#   K covered pixels: gather -> [K,10] -> model -> scatter into the background.
+# ---------------------------------------------------------------------------
+
+def coverage_mask(x, channel, empty_value=1.0, eps=1e-6):
+    """
+    Derive the active-pixel mask from one NHWC input channel (e.g. accumulated alpha).
+    A pixel is inactive when x[..., channel] == empty_value (within eps).
+    Works for torch tensors and NumPy arrays; returns a bool mask of shape x.shape[:-1].
+    """
+    c = x[..., channel]
+    return abs(c - empty_value) > eps
+
+
+def _background_rows(background, n, dtype, device):
+    """background: scalar, [3] colour or a full [..., 3] frame -> [n, 3] tensor (a fresh copy)."""
+    bg = torch.as_tensor(background, dtype=dtype, device=device)
+    if bg.dim() <= 1:
+        return bg.expand(n, 3).clone()
+    return bg.reshape(n, 3).clone()
+
+
+@torch.no_grad()
+def masked_forward_torch(model, x, mask=None, background=0.0, mask_channel=None, empty_value=1.0):
+    """
+    Sparse forward for NHWC frames.
+      x         : [N,H,W,10] or [H,W,10]
+      mask      : bool, x.shape[:-1]; True = run the model for this pixel
+      background: value for inactive pixels (scalar, [3] or a prefilled [...,3] frame)
+      mask_channel / empty_value: when mask is None, derive it with coverage_mask
+    Returns [N,H,W,3] (or [H,W,3]) with model output at active pixels.
+    """
+    if mask is None:
+        if mask_channel is None:
+            raise ValueError("Either mask or mask_channel is required")
+        mask = coverage_mask(x, mask_channel, empty_value)
+    flat = x.reshape(-1, x.size(-1))
+    idx = mask.reshape(-1).nonzero().squeeze(1)
+    out = _background_rows(background, flat.size(0), x.dtype, x.device)
+    if idx.numel() > 0:
+        active = flat.index_select(0, idx)                             # [K,10]
+        if isinstance(model, DFAOITNetConv):
+            y = model(active.t()[None, :, None, :])[0, :, 0, :].t()     # [1,10,1,K] -> [K,3]
+        else:
+            y = model(active)                                          # [K,3]
+        out.index_copy_(0, idx, y.to(out.dtype))
+    return out.view(*x.shape[:-1], 3)
+
+
+_ORT_DTYPES = {'tensor(float)': np.float32, 'tensor(float16)': np.float16}
+
+
+def masked_forward_onnx(session, x, mask=None, background=0.0, mask_channel=None, empty_value=1.0):
+    """
+    ONNX Runtime version of masked_forward_torch (x / mask are NumPy arrays, NHWC).
+    The model needs dynamic spatial axes: the K active pixels are fed as a
+    [1,1,K,10] (NHWC export) or [1,10,1,K] (NCHW export) frame.
+    """
+    if mask is None:
+        if mask_channel is None:
+            raise ValueError("Either mask or mask_channel is required")
+        mask = coverage_mask(x, mask_channel, empty_value)
+    inp = session.get_inputs()[0]
+    shape = inp.shape
+    if len(shape) != 4:
+        raise ValueError(f"Expected a 4D model input, got {shape}")
+    nchw = shape[1] == 10
+    spatial = shape[2:] if nchw else shape[1:3]
+    if all(isinstance(d, int) for d in spatial):
+        raise ValueError(f"Masked inference needs dynamic H/W axes, model input is fixed at {shape}")
+    in_dtype = _ORT_DTYPES.get(inp.type, np.float32)
+
+    flat = x.reshape(-1, x.shape[-1])
+    idx = np.flatnonzero(mask.reshape(-1))
+    bg = np.asarray(background, dtype=np.float32)
+    if bg.ndim <= 1:
+        out = np.empty((flat.shape[0], 3), dtype=np.float32)
+        out[...] = bg
+    else:
+        out = bg.reshape(-1, 3).copy()
+
+    if idx.size > 0:
+        active = flat[idx].astype(in_dtype, copy=False)                # [K,10]
+        if nchw:
+            feed = np.ascontiguousarray(active.T)[None, :, None, :]    # [1,10,1,K]
+            y = session.run(None, {inp.name: feed})[0][0, :, 0, :].T
+        else:
+            y = session.run(None, {inp.name: active[None, None]})[0][0, 0]
+        out[idx] = y
+    return out.reshape(*x.shape[:-1], 3)
+
+
+def benchmark_masked(run_dense, run_masked, height=1080, width=1920,
+                     coverages=(0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0), repeats=5, seed=0,
+                     mask_channel=None, empty_value=1.0):
+    """
+    Time dense vs masked inference on one NHWC frame for several coverage ratios.
+      run_dense(x)        -> [H,W,3]
+      run_masked(x, mask) -> [H,W,3]
+    x / mask are NumPy arrays; the runners convert as needed.
+    With mask_channel set, uncovered pixels get empty_value in that channel and run_masked
+    receives mask=None, so deriving the mask (coverage_mask) is part of the timed path.
+    Returns a list of dicts: coverage, dense_ms, masked_ms, speedup, max_diff.
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.random((height, width, 10), dtype=np.float32)
+
+    def timed(fn, *args):
+        fn(*args)  # warm-up
+        best, y = float('inf'), None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            y = fn(*args)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000.0, np.asarray(y, dtype=np.float32)
+
+    dense_ms, dense = timed(run_dense, x) if mask_channel is None else (None, None)
+    results = []
+    for cov in coverages:
+        mask = rng.random((height, width)) < cov
+        if mask_channel is None:
+            masked_ms, sparse = timed(run_masked, x, mask)
+        else:
+            # 把覆盖率编码进输入通道，掩码由 run_masked 自己从通道推出
+            channel = x[..., mask_channel]
+            channel[~mask] = empty_value
+            clash = mask & (np.abs(channel - empty_value) <= 1e-6)
+            channel[clash] = empty_value + 0.5
+            dense_ms, dense = timed(run_dense, x)
+            masked_ms, sparse = timed(run_masked, x, None)
+        max_diff = float(np.abs(sparse[mask] - dense[mask]).max()) if mask.any() else 0.0
+        results.append({
+            'coverage': float(mask.mean()),
+            'dense_ms': dense_ms,
+            'masked_ms': masked_ms,
+            'speedup': dense_ms / masked_ms,
+            'max_diff': max_diff,
+        })
+        logger.info(f"coverage={mask.mean():.2%} dense={dense_ms:.2f}ms masked={masked_ms:.2f}ms")
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Layout-agnostic ingest
+#   An NHWC buffer and a channels_last NCHW tensor are the same memory, so the
+#   front end only permutes views and picks the kernel that reads that memory
+#   directly: matmul over the last dim (channels innermost) or 1x1 conv (NCHW).
+# ---------------------------------------------------------------------------
+
+def to_channels_last(model):
+    """Convert a DFAOITNetConv(-NHWC) model's weights to channels_last (in place)."""
+    return model.to(memory_format=torch.channels_last)
+
+
+class LayoutAgnosticRunner:
+    """
+    Run any DFAOIT model on NHWC or NCHW input without materializing a transposed copy.
+      NHWC [N,H,W,10]                    -> [N,H,W,3]
+      NCHW [N,10,H,W], channels_last     -> [N,3,H,W] (channels_last)
+      NCHW [N,10,H,W], contiguous        -> [N,3,H,W] (contiguous)
+    """
+    def __init__(self, model):
+        layers, self.sigmoid = mlp_weights(model)
+        self.linear = [(w.detach(), b.detach()) for w, b in layers]
+        self.conv = [(w[..., None, None].contiguous(), b) for w, b in self.linear]
+
+    @torch.no_grad()
+    def _run_linear(self, x):
+        (w1, b1), (w2, b2), (w3, b3) = self.linear
+        x = F.linear(x, w1, b1).relu_()
+        x = F.linear(x, w2, b2).relu_()
+        x = F.linear(x, w3, b3)
+        return x.sigmoid_() if self.sigmoid else x
+
+    @torch.no_grad()
+    def _run_conv(self, x):
+        (w1, b1), (w2, b2), (w3, b3) = self.conv
+        x = F.conv2d(x, w1, b1).relu_()
+        x = F.conv2d(x, w2, b2).relu_()
+        x = F.conv2d(x, w3, b3)
+        return x.sigmoid_() if self.sigmoid else x
+
+    def __call__(self, x, layout='NHWC'):
+        if x.dim() != 4:
+            raise ValueError(f"Expected a 4D frame, got {tuple(x.shape)}")
+        if layout == 'NHWC':
+            if x.is_contiguous():
+                return self._run_linear(x)
+            # NHWC logical shape over NCHW memory: run the conv on the NCHW view
+            return self._run_conv(x.permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+        if layout == 'NCHW':
+            if x.is_contiguous(memory_format=torch.channels_last):
+                return self._run_linear(x.permute(0, 2, 3, 1)).permute(0, 3, 1, 2)
+            return self._run_conv(x)
+        raise ValueError(f"Unknown layout '{layout}', expected NHWC or NCHW")
+
+
+def benchmark_layout(model, height=1080, width=1920, repeats=5, seed=0):
+    """
+    Per-frame cost of feeding an NHWC capture buffer to DFAOITNetConv:
+      permute_copy : x.permute(0,3,1,2).contiguous() then the NCHW model (old path)
+      channels_last: channels_last model on the permuted view (no copy)
+      runner       : LayoutAgnosticRunner on the NHWC buffer
+    For each path: best latency (ms) and time spent copying the input frame (ms) from the profiler,
+    i.e. copy kernels whose input is the [1,H,W,10] / [1,10,H,W] frame (addmm / conv copying their
+    bias into the output are not counted).
+    """
+    from torch.profiler import profile, ProfilerActivity
+
+    x = torch.rand(1, height, width, 10, generator=torch.Generator().manual_seed(seed))
+    model_cl = to_channels_last(copy.deepcopy(model))
+    runner = LayoutAgnosticRunner(model)
+    paths = {
+        'permute_copy': lambda: model(x.permute(0, 3, 1, 2).contiguous()),
+        'channels_last': lambda: model_cl(x.permute(0, 3, 1, 2)),
+        'runner': lambda: runner(x, 'NHWC'),
+    }
+    copy_ops = ('aten::contiguous', 'aten::clone', 'aten::copy_')
+    frame_shapes = ([1, height, width, 10], [1, 10, height, width])
+    results = {}
+    with torch.no_grad():
+        for name, fn in paths.items():
+            fn()  # warm-up
+            best = float('inf')
+            for _ in range(repeats):
+                start = time.perf_counter()
+                fn()
+                best = min(best, time.perf_counter() - start)
+            with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+                fn()
+            copy_us = sum(e.self_cpu_time_total for e in prof.key_averages(group_by_input_shape=True)
+                          if e.key in copy_ops and any(shape in frame_shapes for shape in e.input_shapes))
+            results[name] = {'ms': best * 1000.0, 'copy_ms': copy_us / 1000.0}
+            logger.info(f"{name}: {best * 1000.0:.2f} ms, copies {copy_us / 1000.0:.2f} ms")
+    return results
+
+
+# ONNX Runtime element type strings -> NumPy dtypes of the exports (fp32 / fp16)
+ORT_DTYPES = {'tensor(float)': np.float32, 'tensor(float16)': np.float16}
+
+
+def onnx_io_dtypes(session):
+    """(input dtype, output dtype) of a session's first input / output, as NumPy dtypes."""
+    types = (session.get_inputs()[0].type, session.get_outputs()[0].type)
+    if any(t not in ORT_DTYPES for t in types):
+        raise ValueError(f"Unsupported ONNX input / output types {types}")
+    return tuple(ORT_DTYPES[t] for t in types)
+
+
+def onnx_input_layout(session):
+    """'NCHW' / 'NHWC' from the session's first input shape (channels = 10)."""
+    shape = session.get_inputs()[0].shape
+    if len(shape) == 4 and shape[1] == 10:
+        return 'NCHW'
+    if len(shape) == 4 and shape[-1] == 10:
+        return 'NHWC'
+    raise ValueError(f"Not a frame model input: {shape}")
+
+
+class LayoutRoutedOnnx:
+    """
+    ONNX has no notion of memory format, so a transposed copy is avoided by choosing
+    the export whose input layout matches the buffer: NHWC buffers (and channels_last
+    NCHW tensors, which are the same memory) go to the NHWC session, contiguous NCHW
+    tensors to the NCHW one. With a single session the other layout costs one copy.
+    """
+    def __init__(self, sessions):
+        self.sessions = {}
+        for session in sessions:
+            self.sessions[onnx_input_layout(session)] = session
+        if not self.sessions:
+            raise ValueError("No ONNX sessions given")
+
+    def __call__(self, x, layout='NHWC'):
+        """x: torch tensor in `layout` (NHWC [N,H,W,10] or NCHW [N,10,H,W]); output in the same layout."""
+        if layout not in ('NHWC', 'NCHW'):
+            raise ValueError(f"Unknown layout '{layout}', expected NHWC or NCHW")
+        nhwc = x if layout == 'NHWC' else x.permute(0, 2, 3, 1)
+        want = 'NHWC' if nhwc.is_contiguous() else 'NCHW'
+        if want not in self.sessions:
+            want = 'NCHW' if want == 'NHWC' else 'NHWC'
+        session = self.sessions[want]
+        feed = nhwc if want == 'NHWC' else nhwc.permute(0, 3, 1, 2)
+        # contiguous() is a no-op when the buffer already matches the session layout
+        feed = feed.contiguous().numpy().astype(onnx_io_dtypes(session)[0], copy=False)
+        y = torch.from_numpy(session.run(None, {session.get_inputs()[0].name: feed})[0]).float()
+        y = y if want == 'NHWC' else y.permute(0, 2, 3, 1)
+        return y if layout == 'NHWC' else y.permute(0, 3, 1, 2)
+
+
+def benchmark_layout_onnx(sessions, height=1080, width=1920, repeats=5, seed=0):
+    """
+    Per-frame cost of feeding an NHWC capture buffer to ONNX exports (NHWC and / or NCHW):
+      <layout>_export: that session, the buffer transposed to its layout on every frame
+      routed         : LayoutRoutedOnnx, which feeds the buffer to the session matching it
+    For each path: best latency (ms) and the per-frame transpose copy (ms, timed on its own).
+    """
+    x = torch.rand(1, height, width, 10, generator=torch.Generator().manual_seed(seed))
+    router = LayoutRoutedOnnx(sessions)
+
+    def best_ms(fn):
+        fn()  # warm-up
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best * 1000.0
+
+    transpose_ms = best_ms(lambda: x.permute(0, 3, 1, 2).contiguous())
+    results = {}
+    for layout, session in router.sessions.items():
+        def run(session=session, layout=layout):
+            feed = x if layout == 'NHWC' else x.permute(0, 3, 1, 2).contiguous()
+            feed = feed.numpy().astype(onnx_io_dtypes(session)[0], copy=False)
+            return session.run(None, {session.get_inputs()[0].name: feed})
+        results[f'{layout.lower()}_export'] = {'ms': best_ms(run), 'copy_ms': transpose_ms if layout == 'NCHW' else 0.0}
+    results['routed'] = {'ms': best_ms(lambda: router(x, 'NHWC')),
+                         'copy_ms': 0.0 if 'NHWC' in router.sessions else transpose_ms}
+    logger.info(f"onnx layout: {results}")
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Constant-channel folding
+#   Channels that are constant over a frame (e.g. background colour terms)
+#   contribute W1[:, c] * v to every pixel, so they fold into layer1's bias and
+#   layer1 reads only the channels that vary.
+# ---------------------------------------------------------------------------
+
+@torch.no_grad()
+def constant_channels(x, atol=0.0, sample_stride=997, min_count=0):
+    """
+    {channel: value} of the channels of x ([..., C]) that are constant over all pixels
+    (|x - first pixel| <= atol). A strided pixel sample rules channels out cheaply; only
+    the remaining candidates are checked over the whole frame, in one min / max pass.
+    Returns {} without the full pass when fewer than `min_count` candidates survive the sample.
+    """
+    flat = x.reshape(-1, x.size(-1))
+    first = flat[0]
+    sample = flat[::sample_stride]
+    candidates = torch.nonzero(((sample - first).abs() <= atol).all(0)).flatten()
+    if len(candidates) == 0 or len(candidates) < min_count:
+        return {}
+    cols = candidates.tolist()
+    lo, hi = cols[0], cols[-1] + 1
+    low, high = flat[:, lo:hi].aminmax(dim=0)   # strided view, no temporaries of frame size
+    ok = ((high - first[lo:hi]) <= atol) & ((first[lo:hi] - low) <= atol)
+    return {c: float(first[c]) for c in cols if ok[c - lo]}
+
+
+class ConstantFoldedRunner:
+    """
+    Per-pixel MLP on [..., 10] input with constant channels folded into layer1.
+
+        runner = ConstantFoldedRunner(model)
+        y = runner(frame, constants={7: 0.2, 8: 0.3, 9: 0.4})   # declared per frame
+        y = runner(frame, detect=True)                          # opt-in detection
+
+    The folded path gathers the varying channels once and runs layer1 against the
+    matching W1 columns, with the constant channels folded into its bias; when every
+    channel is constant the output is a single pixel broadcast over the frame. It is
+    only taken when at most `max_varying` channels vary, otherwise the frame goes
+    through the dense path (forward_into_torch). On CPU layer1 is bound by writing its
+    hidden activations, not by its input width, so narrowing it does not pay and the
+    default only folds fully constant frames; raise max_varying where it does.
+    Declared constants are trusted (their channels are not read). Detection is off by
+    default; it only scans the whole frame when a pixel sample allows a fold.
+    Specialized layer1 weights are cached per constant set in an LRU of `cache_size` entries.
+    """
+    def __init__(self, model, cache_size=32, atol=0.0, max_varying=0):
+        self.model = model
+        layers, self.sigmoid = mlp_weights(model)
+        self.layers = [(w.detach(), b.detach()) for w, b in layers]
+        self.in_channels = self.layers[0][0].shape[1]
+        self.cache_size = cache_size
+        self.atol = atol
+        self.max_varying = max_varying
+        self._cache = OrderedDict()
+        self.hits = self.misses = 0
+
+    def specialize(self, constants):
+        """(varying channel index, layer1 weight [hidden, len(varying)], folded layer1 bias) for a constant set."""
+        # values rounded to the weight dtype, so declared and detected constants share an entry
+        key = tuple(sorted((int(c), float(np.float32(v))) for c, v in constants.items()))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        self.misses += 1
+        w1, b1 = self.layers[0]
+        const = torch.tensor([c for c, _ in key], dtype=torch.long)
+        values = torch.tensor([v for _, v in key], dtype=w1.dtype)
+        bias = b1 + w1[:, const] @ values
+        varying = torch.tensor([c for c in range(self.in_channels) if c not in dict(key)], dtype=torch.long)
+        spec = (varying, w1[:, varying].contiguous(), bias)
+        self._cache[key] = spec
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return spec
+
+    @torch.no_grad()
+    def dense(self, x):
+        if x.size(-1) != self.in_channels:
+            raise ValueError(f"Expected [..., {self.in_channels}], got {tuple(x.shape)}")
+        out = x.new_empty(*x.shape[:-1], self.layers[2][0].size(0))
+        return forward_into_torch(self.layers, self.sigmoid, x.contiguous(), out)
+
+    @torch.no_grad()
+    def __call__(self, x, constants=None, detect=False):
+        if x.size(-1) != self.in_channels:
+            raise ValueError(f"Expected [..., {self.in_channels}], got {tuple(x.shape)}")
+        min_constant = self.in_channels - self.max_varying
+        constants = dict(constants or {})
+        if detect and len(constants) < min_constant:
+            found = constant_channels(x, self.atol, min_count=min_constant - len(constants))
+            for c, v in found.items():
+                constants.setdefault(c, v)
+        if len(constants) < min_constant:
+            return self.dense(x)
+
+        varying, w1, b1 = self.specialize(constants)
+        if len(varying) == 0:  # every channel constant: one pixel for the whole frame
+            (w2, b2), (w3, b3) = self.layers[1:]
+            pixel = torch.addmm(b3, F.linear(b1.relu()[None], w2, b2).relu_(), w3.t())
+            pixel = pixel.sigmoid_() if self.sigmoid else pixel
+            return pixel.expand(x[..., 0].numel(), -1).contiguous().view(*x.shape[:-1], -1)
+        out = x.new_empty(*x.shape[:-1], self.layers[2][0].size(0))
+        return forward_into_torch([(w1, b1)] + self.layers[1:], self.sigmoid, x.index_select(-1, varying), out)
+
+    @torch.no_grad()
+    def verify(self, x, constants=None, detect=False):
+        """Max abs difference between this runner and the model's own forward on x ([..., 10])."""
+        y = self(x, constants, detect)
+        reference = dense_forward_torch(self.model, x.reshape(-1, 1, self.in_channels))
+        return (y - reference.reshape(y.shape)).abs().max().item()
+
+
+def benchmark_constant_folding(model, height=1080, width=1920, constant=(7, 8, 9), frames=4,
+                               repeats=3, seed=0, max_varying=0):
+    """
+    Dense vs folded forward on NHWC frames whose `constant` channels hold one random value per frame.
+    Reports best ms per frame for the dense path (forward_into_torch), the runner with declared
+    constants and with (opt-in) detection, whether the folded path was taken, the worst max abs
+    difference against the model's own forward, and the specialization cache hits / misses.
+    """
+    g = torch.Generator().manual_seed(seed)
+    runner = ConstantFoldedRunner(model, max_varying=max_varying)
+    batch = []
+    for _ in range(frames):
+        x = torch.rand(1, height, width, 10, generator=g)
+        values = torch.rand(len(constant), generator=g)
+        x[..., list(constant)] = values
+        batch.append((x, dict(zip(constant, values.tolist()))))
+
+    def best_ms(fn):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for x, consts in batch:
+                fn(x, consts)
+            best = min(best, time.perf_counter() - start)
+        return best * 1000.0 / frames
+
+    results = {
+        'dense_ms': best_ms(lambda x, c: runner.dense(x)),
+        'declared_ms': best_ms(lambda x, c: runner(x, c)),
+        'detect_ms': best_ms(lambda x, c: runner(x, detect=True)),
+        'max_diff': max(max(runner.verify(x, c), runner.verify(x, detect=True)) for x, c in batch),
+    }
+    results['folded'] = len(set(constant)) >= runner.in_channels - max_varying
+    results['hits'], results['misses'] = runner.hits, runner.misses
+    logger.info(f"constant folding: {results}")
+    return results
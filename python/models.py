@@ -9,11 +9,11 @@ class DFAOITNet(nn.Module):
       input : [N, H, W, 10]
       output: [N, H, W, 3]  (RGB in [0,1])
     """
-    def __init__(self):
+    def __init__(self, hidden1: int = 32, hidden2: int = 16):
         super().__init__()
-        self.layer1 = nn.Linear(10, 32)
-        self.layer2 = nn.Linear(32, 16)
-        self.layer3 = nn.Linear(16, 3)
+        self.layer1 = nn.Linear(10, hidden1)
+        self.layer2 = nn.Linear(hidden1, hidden2)
+        self.layer3 = nn.Linear(hidden2, 3)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         if x.dim() != 2 and x.dim() != 4 or x.size(-1) != 10:
@@ -31,12 +31,14 @@ class DFAOITNetConv(nn.Module):
     NCHW-only
       input : [N,10, H, W]
       output: [N, 3, H, W]  (RGB in [0,1])
+    Input may be contiguous or channels_last (e.g. an NHWC buffer viewed with
+    permute(0,3,1,2)); the output keeps the input's memory format.
     """
-    def __init__(self):
+    def __init__(self, hidden1: int = 32, hidden2: int = 16):
         super().__init__()
-        self.layer1 = nn.Conv2d(10, 32, 1, bias=True)
-        self.layer2 = nn.Conv2d(32, 16, 1, bias=True)
-        self.layer3 = nn.Conv2d(16, 3, 1, bias=True)
+        self.layer1 = nn.Conv2d(10, hidden1, 1, bias=True)
+        self.layer2 = nn.Conv2d(hidden1, hidden2, 1, bias=True)
+        self.layer3 = nn.Conv2d(hidden2, 3, 1, bias=True)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
 
@@ -47,6 +49,57 @@ class DFAOITNetConv(nn.Module):
         return x
 
 
+class DFAOITNetConvNHWC(DFAOITNetConv):
+    """
+    DFAOITNetConv fed with NHWC buffers (same state_dict as DFAOITNetConv)
+      input : [N, H, W, 10]
+      output: [N, H, W, 3]
+    permute(0,3,1,2) of an NHWC buffer is a channels_last view, so no transposed copy is made.
+    """
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if x.dim() != 4 or x.size(-1) != 10:
+            raise ValueError(f"Expected NHWC [N, H, W, 10], got {tuple(x.shape)}")
+        y = super().forward(x.permute(0, 3, 1, 2))   # [N,3,H,W] channels_last
+        return y.permute(0, 2, 3, 1)                   # [N,H,W,3] contiguous view
+
+
+class LowRankLinear(nn.Module):
+    """
+    Linear layer factorized as up(down(x)): W [out,in] ~= up.weight [out,r] @ down.weight [r,in].
+    weight / bias expose the equivalent dense layer, so code reading layer.weight keeps working.
+    """
+    def __init__(self, in_features: int, out_features: int, rank: int):
+        super().__init__()
+        self.in_features, self.out_features, self.rank = in_features, out_features, rank
+        self.down = nn.Linear(in_features, rank, bias=False)
+        self.up = nn.Linear(rank, out_features)
+
+    @property
+    def weight(self) -> torch.Tensor:
+        return self.up.weight @ self.down.weight
+
+    @property
+    def bias(self) -> torch.Tensor:
+        return self.up.bias
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.up(self.down(x))
+
+
+class DFAOITNetLowRank(DFAOITNet):
+    """
+    DFAOITNet with layer1 / layer2 optionally factorized (rank None = dense layer).
+      input : [N, 10] or [N, H, W, 10]
+      output: [N, 3]  or [N, H, W, 3]
+    """
+    def __init__(self, hidden1: int = 32, hidden2: int = 16, rank1=None, rank2=None):
+        super().__init__(hidden1, hidden2)
+        if rank1:
+            self.layer1 = LowRankLinear(10, hidden1, rank1)
+        if rank2:
+            self.layer2 = LowRankLinear(hidden1, hidden2, rank2)
+
+
 class DFAOITNetShaderVersion(nn.Module):
     """
     NHWC-only（固定权重版）
@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_OPT_LEVELS = ('disable', 'basic', 'extended', 'all')
+
+# ONNX Runtime defaults, used for keys missing from a sidecar
+DEFAULT_CONFIG = {
+    'intra_op_num_threads': 0,          # 0 = ORT picks (all physical cores)
+    'inter_op_num_threads': 0,
+    'execution_mode': 'sequential',
+    'graph_optimization_level': 'all',
+    'enable_cpu_mem_arena': True,
+    'enable_mem_pattern': True,
+}
+
+
+def sidecar_path(onnx_path):
+    """model.onnx -> model.ort.json"""
+    return os.path.splitext(onnx_path)[0] + '.ort.json'
+
+
+def load_sidecar(onnx_path):
+    """Tuned session config saved next to the model, or None."""
+    path = sidecar_path(onnx_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get('config')
+
+
+def session_options(config):
+    import onnxruntime as ort
+    cfg = dict(DEFAULT_CONFIG, **(config or {}))
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = int(cfg['intra_op_num_threads'])
+    opts.inter_op_num_threads = int(cfg['inter_op_num_threads'])
+    opts.execution_mode = {
+        'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+        'parallel': ort.ExecutionMode.ORT_PARALLEL,
+    }[cfg['execution_mode']]
+    opts.graph_optimization_level = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[cfg['graph_optimization_level']]
+    opts.enable_cpu_mem_arena = bool(cfg['enable_cpu_mem_arena'])
+    opts.enable_mem_pattern = bool(cfg['enable_mem_pattern'])
+    return opts
+
+
+def create_session(onnx_path, config=None, use_sidecar=True):
+    """
+    CPU InferenceSession for onnx_path. Session options come from `config` if given,
+    otherwise from the model's tuned sidecar (see `tune`), otherwise ORT defaults.
+    """
+    import onnxruntime as ort
+    if config is None and use_sidecar:
+        config = load_sidecar(onnx_path)
+        if config is not None:
+            logger.info(f"Using tuned session options from {sidecar_path(onnx_path)}")
+    return ort.InferenceSession(onnx_path, sess_options=session_options(config),
+                                providers=['CPUExecutionProvider'])
+
+
+def example_feed(session, height, width, seed=0):
+    """Random input for the session's first input at the given resolution (N=1, NHWC or NCHW by graph)."""
+    inp = session.get_inputs()[0]
+    shape = list(inp.shape)
+    if len(shape) == 4 and shape[1] == 10:
+        concrete = [1, 10, height, width]
+    elif len(shape) == 4:
+        concrete = [1, height, width, 10]
+    else:
+        concrete = [height * width, 10]
+    # fixed dims in the graph win over the requested resolution
+    concrete = [d if isinstance(d, int) and d > 0 else c for d, c in zip(shape, concrete)]
+    dtype = np.float16 if inp.type == 'tensor(float16)' else np.float32
+    x = np.random.default_rng(seed).random(concrete, dtype=np.float32).astype(dtype)
+    return {inp.name: x}
+
+
+def time_session(session, feed, warmup=2, repeats=10):
+    """Median and min latency (ms) of session.run over warm runs."""
+    for _ in range(warmup):
+        session.run(None, feed)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        session.run(None, feed)
+        times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times)), float(np.min(times))
+
+
+def _thread_candidates(max_threads):
+    counts, n = [], 1
+    while n < max_threads:
+        counts.append(n)
+        n *= 2
+    counts.append(max_threads)
+    return counts
+
+
+def tune(onnx_path, height=1080, width=1920, warmup=2, repeats=10, max_threads=None, save=True):
+    """
+    Search ONNX Runtime session options for the lowest median latency on one input
+    of the target resolution. The search is coordinate-wise, one option group at a time:
+      1. intra-op threads
+      2. execution mode (+ inter-op threads for parallel)
+      3. graph optimization level
+      4. memory arena / memory pattern
+    The best config is written to the model's sidecar (model.ort.json) unless save=False.
+    Returns (best_config, trials) where trials is a list of (config, median_ms, min_ms).
+    """
+    import onnxruntime as ort
+
+    max_threads = max_threads or os.cpu_count() or 1
+    trials = []
+    cache = {}
+
+    def measure(cfg):
+        key = json.dumps(cfg, sort_keys=True)
+        if key not in cache:
+            session = create_session(onnx_path, config=cfg)
+            feed = example_feed(session, height, width)
+            median_ms, min_ms = time_session(session, feed, warmup, repeats)
+            cache[key] = median_ms
+            trials.append((dict(cfg), median_ms, min_ms))
+            logger.info(f"{cfg} -> {median_ms:.3f} ms")
+        return cache[key]
+
+    def best_of(base, variants):
+        candidates = [dict(base, **v) for v in variants]
+        return min(candidates, key=measure)
+
+    best = dict(DEFAULT_CONFIG)
+    measure(best)  # baseline: ORT defaults
+    best = best_of(best, [{'intra_op_num_threads': n} for n in [0] + _thread_candidates(max_threads)])
+    best = best_of(best, [{'execution_mode': 'sequential', 'inter_op_num_threads': 0}] +
+                         [{'execution_mode': 'parallel', 'inter_op_num_threads': n}
+                          for n in _thread_candidates(min(4, max_threads))])
+    best = best_of(best, [{'graph_optimization_level': lvl} for lvl in _OPT_LEVELS])
+    best = best_of(best, [{'enable_cpu_mem_arena': a, 'enable_mem_pattern': m}
+                          for a in (True, False) for m in (True, False)])
+
+    if save:
+        with open(sidecar_path(onnx_path), 'w', encoding='utf-8') as f:
+            json.dump({
+                'config': best,
+                'median_ms': cache[json.dumps(best, sort_keys=True)],
+                'height': height,
+                'width': width,
+                'onnxruntime': ort.__version__,
+                'cpu_count': os.cpu_count(),
+                'tuned_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            }, f, indent=2)
+        logger.info(f"Saved tuned config to {sidecar_path(onnx_path)}")
+    return best, trials
@@ -0,0 +1,167 @@
+import time
+import logging
+
+import numpy as np
+
+from utils import output_error_metrics
+
+logger = logging.getLogger(__name__)
+
+# name -> (dtype, values per pixel, max code or None for float formats)
+FORMATS = {
+    'fp32': (np.float32, 3, None),
+    'fp16': (np.float16, 3, None),
+    'rgb8': (np.uint8, 3, 255),
+    'rgba8': (np.uint8, 4, 255),
+    'rgb10a2': (np.uint32, 1, 1023),   # R bits 0-9, G 10-19, B 20-29, A 30-31 (R10G10B10A2_UNORM)
+}
+
+_RGB10_SHIFTS = np.array([0, 10, 20], dtype=np.uint32)
+
+
+def output_shape(fmt, shape):
+    """Output array shape of format `fmt` for pixel dims `shape`, e.g. (H, W) -> (H, W, 3)."""
+    _, channels, _ = FORMATS[fmt]
+    return tuple(shape) + ((channels,) if channels > 1 else ())
+
+
+def bytes_per_pixel(fmt):
+    dtype, channels, _ = FORMATS[fmt]
+    return np.dtype(dtype).itemsize * channels
+
+
+def allocate_output(fmt, shape, path=None):
+    """Output buffer for `shape` pixels; a memory-mapped .npy file when path is given."""
+    dtype = FORMATS[fmt][0]
+    full_shape = output_shape(fmt, shape)
+    if path:
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=full_shape)
+    return np.empty(full_shape, dtype=dtype)
+
+
+def dequantize(fmt, q, peak=1.0):
+    """fp32 RGB [..., 3] back from a buffer of format `fmt` (alpha is dropped)."""
+    _, _, levels = FORMATS[fmt]
+    if fmt == 'rgb10a2':
+        q = (q[..., None] >> _RGB10_SHIFTS) & 0x3FF
+    elif fmt == 'rgba8':
+        q = q[..., :3]
+    q = q.astype(np.float32)
+    return q * np.float32(peak / levels) if levels else q
+
+
+class QuantizedWriter:
+    """
+    Final output stage: clamp to [0, peak], scale to the format's code range, round and
+    pack, writing straight into a preallocated (or memory-mapped / shared-memory) buffer.
+
+    forward() runs the model in row chunks into a small reusable scratch of the model's
+    native output dtype (run.out_dtype: fp32, or fp16 for fp16 exports) and quantizes
+    each chunk while it is still in cache, so the full-frame output is never
+    materialized (chunking also keeps the hidden activations in cache, which makes it
+    faster than a full-frame pass even for fp32 output):
+
+        writer = QuantizedWriter('rgb10a2')
+        out = allocate_output('rgb10a2', (H, W), 'frame.npy')
+        writer.forward(run, x, out)          # run(x_rows, out_rows) from make_frame_runner
+    """
+    def __init__(self, fmt='fp32', peak=1.0, alpha=1.0, chunk_pixels=1 << 16):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format '{fmt}', expected one of {tuple(FORMATS)}")
+        self.fmt, self.peak, self.chunk_pixels = fmt, peak, chunk_pixels
+        _, self.channels, self.levels = FORMATS[fmt]
+        self.scale = np.float32(self.levels / peak) if self.levels else None
+        alpha = float(np.clip(alpha, 0.0, 1.0))
+        # 常量 alpha 预先量化好
+        self.alpha_code = np.uint8(round(alpha * 255))
+        self.alpha_bits = np.uint32(round(alpha * 3) << 30)
+        self._scratch = None
+        self._codes = None
+
+    def _scratch_rows(self, pixels, dtype=np.float32):
+        if self._scratch is None or len(self._scratch) < pixels or self._scratch.dtype != dtype:
+            self._scratch = np.empty((pixels, 3), dtype=dtype)
+        return self._scratch[:pixels]
+
+    def write(self, src, dst):
+        """Quantize fp32 / fp16 src [P, 3] (overwritten) into dst [P, C] / [P] of this format."""
+        if self.fmt in ('fp32', 'fp16'):
+            np.copyto(dst, src, casting='same_kind')
+            return dst
+        np.multiply(src, self.scale, out=src)
+        np.clip(src, 0.0, self.levels, out=src)
+        np.rint(src, out=src)
+        if self.fmt == 'rgb8':
+            np.copyto(dst, src, casting='unsafe')
+        elif self.fmt == 'rgba8':
+            np.copyto(dst[:, :3], src, casting='unsafe')
+            dst[:, 3] = self.alpha_code
+        else:
+            if self._codes is None or len(self._codes) < len(src):
+                self._codes = np.empty((len(src), 3), dtype=np.uint32)
+            codes = self._codes[:len(src)]
+            np.copyto(codes, src, casting='unsafe')
+            np.left_shift(codes, _RGB10_SHIFTS, out=codes)
+            np.bitwise_or.reduce(codes, axis=1, out=dst)
+            np.bitwise_or(dst, self.alpha_bits, out=dst)
+        return dst
+
+    def forward(self, run, x, dst, rows=None):
+        """
+        run(x, out): NHWC forward, x [h,W,10] -> out [h,W,3] in place, out of dtype
+        run.out_dtype (fp32 when the attribute is missing).
+        x: [H,W,10] frame, dst: output_shape(fmt, (H, W)) buffer.
+        rows: rows per chunk (default: ~chunk_pixels); pass H for runners that need the
+        full frame (fixed-shape ONNX models).
+        """
+        height, width = x.shape[:2]
+        rows = min(height, rows or max(1, self.chunk_pixels // width))
+        dtype = np.dtype(getattr(run, 'out_dtype', np.float32))
+        if self.channels == 3 and not self.levels and dst.dtype == dtype:
+            # fp32 (fp16) rows of dst are written by an fp32 (fp16) model directly
+            for r0 in range(0, height, rows):
+                run(x[r0:r0 + rows], dst[r0:r0 + rows])
+            return dst
+        scratch = self._scratch_rows(rows * width, dtype)
+        for r0 in range(0, height, rows):
+            r1 = min(height, r0 + rows)
+            pixels = (r1 - r0) * width
+            out = scratch[:pixels]
+            run(x[r0:r1], out.reshape(r1 - r0, width, 3))
+            self.write(out, dst[r0:r1].reshape((pixels,) + dst.shape[2:]))
+        return dst
+
+
+def format_report(run, x, formats=None, peak=1.0, repeats=3, rows=None):
+    """
+    Per output format on frame x [H,W,10]: best-of-`repeats` forward + write time,
+    bytes per pixel and error of the dequantized output against the model's output in fp32
+    (for fp16 exports, their fp16 output widened). clipped = fraction of reference values
+    outside [0, peak] (lost by integer formats).
+    """
+    height, width = x.shape[:2]
+    reference = allocate_output('fp32', (height, width))
+    run(x, reference)
+    clipped = float(np.mean((reference < 0) | (reference > peak)))
+
+    rows_out = []
+    for fmt in formats or FORMATS:
+        writer = QuantizedWriter(fmt, peak)
+        dst = allocate_output(fmt, (height, width))
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            writer.forward(run, x, dst, rows)
+            best = min(best, time.perf_counter() - start)
+        metrics = output_error_metrics(reference, dequantize(fmt, dst, peak), peak)
+        rows_out.append({
+            'format': fmt,
+            'bytes_per_pixel': bytes_per_pixel(fmt),
+            'ms': best * 1000.0,
+            'mae': metrics['mae'],
+            'max_abs': metrics['max_abs'],
+            'psnr': metrics['psnr'],
+            'clipped': clipped if FORMATS[fmt][2] else 0.0,
+        })
+        logger.info(f"{fmt}: {best * 1000.0:.2f} ms, mae={metrics['mae']:.2e}")
+    return rows_out
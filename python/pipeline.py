@@ -0,0 +1,328 @@
+import os
+import copy
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import torch
+
+from models import DFAOITNet, DFAOITNetConv, DFAOITNetConvNHWC, DFAOITNetShaderVersion
+from utils import load_existing_weights, adapt_state_dict, hidden_sizes, export_onnx, reshape_onnx, output_error_metrics
+from training import sharded_fine_tune
+from data_cache import DEFAULT_CACHE_DIR, load_consistency_dataset
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = '.pipeline_state.json'
+
+# model_arch -> (class, layout)
+ARCHS = {
+    'DFAOITNet': (DFAOITNet, 'NHWC'),
+    'DFAOITNetConv': (DFAOITNetConv, 'NCHW'),
+    'DFAOITNetConvNHWC': (DFAOITNetConvNHWC, 'NHWC'),
+}
+
+# torch.onnx.export keeps exporter settings in module-level globals, so exports
+# are serialized; everything else (reshape, compare, training) runs concurrently.
+_EXPORT_LOCK = threading.Lock()
+
+
+def default_model():
+    """DFAOITNet initialised with the shader weights (same as create_default_ckpt / train)."""
+    shader = DFAOITNetShaderVersion()
+    model = DFAOITNet()
+    load_existing_weights(model, shader.W1.flatten().tolist(), shader.b1.tolist(),
+                          shader.W2.flatten().tolist(), shader.b2.tolist(),
+                          shader.W3.flatten().tolist(), shader.b3.tolist())
+    return model
+
+
+def _input_shape(layout, h, w):
+    return (1, h, w, 10) if layout == 'NHWC' else (1, 10, h, w)
+
+
+class ArtifactStore:
+    """
+    Artifacts of one pipeline run, kept in memory and keyed by absolute path.
+    A .pth is read from disk at most once, each (pth, arch) model is built once
+    (including the Linear -> 1x1 Conv weight reshaping), and stage outputs are
+    handed to later stages without a round trip through the file system.
+    """
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.RLock()
+
+    def put(self, path, obj):
+        with self._lock:
+            self._items[('file', path)] = obj
+            for key in [k for k in self._items if k[0] == 'model' and k[1] == path]:
+                del self._items[key]
+
+    def _get(self, key, load):
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = load()
+            return self._items[key]
+
+    def state_dict(self, path):
+        return self._get(('file', path), lambda: torch.load(path, map_location='cpu'))
+
+    def onnx(self, path):
+        import onnx
+        return self._get(('file', path), lambda: onnx.load(path))
+
+    def model(self, path, arch):
+        """Shared eval-mode model; callers that modify it must copy it first."""
+        def build():
+            state_dict = self.state_dict(path)
+            model = ARCHS[arch][0](*hidden_sizes(state_dict))
+            model.load_state_dict(adapt_state_dict(state_dict, model))
+            return model.eval()
+        return self._get(('model', path, arch), build)
+
+
+# ---------------------------------------------------------------------------
+# Stage operations: (ctx, params) -> optional result dict
+# ---------------------------------------------------------------------------
+
+def _save_state_dict(ctx, model, path):
+    state_dict = {k: v.detach().cpu().clone() for k, v in model.state_dict().items()}
+    torch.save(state_dict, path)
+    ctx.store.put(path, state_dict)
+
+
+def _op_create_default_ckpt(ctx, p):
+    _save_state_dict(ctx, default_model(), p['output'])
+
+
+def _consistency_train(ctx, model, p):
+    dataset = load_consistency_dataset(
+        model, p.get('samples', 15000), seed=p.get('seed', 0),
+        cache_dir=p.get('cache_dir', DEFAULT_CACHE_DIR), workers=p.get('workers', 0))
+    train_set, val_set = dataset.split()
+    best_path = os.path.join(ctx.workdir, f".{p['name']}_best.pth")
+    sharded_fine_tune(model, train_set, val_set, best_path=best_path)
+    _save_state_dict(ctx, model, p['output'])
+    return {'train': len(train_set), 'val': len(val_set)}
+
+
+def _op_train(ctx, p):
+    return _consistency_train(ctx, default_model(), p)
+
+
+def _op_finetune(ctx, p):
+    state_dict = ctx.store.state_dict(p['init'])
+    model = DFAOITNet(*hidden_sizes(state_dict))
+    model.load_state_dict(adapt_state_dict(state_dict, model))
+    return _consistency_train(ctx, model, p)
+
+
+def _op_export(ctx, p):
+    arch = p.get('model_arch', 'DFAOITNet')
+    layout = ARCHS[arch][1]
+    shape = _input_shape(layout, p.get('dummy_h', 16), p.get('dummy_w', 16))
+    with _EXPORT_LOCK:
+        export_onnx(ctx.store.model(p['pth'], arch), p['output'], shape, layout,
+                    use_dynamic_axes=p.get('use_dynamic_axes', False))
+
+
+def _op_export_fp16(ctx, p):
+    arch = p.get('model_arch', 'DFAOITNet')
+    layout = ARCHS[arch][1]
+    model = copy.deepcopy(ctx.store.model(p['pth'], arch)).half()
+    if p.get('fp16_pth'):
+        _save_state_dict(ctx, model, p['fp16_pth'])
+    shape = _input_shape(layout, p.get('dummy_h', 16), p.get('dummy_w', 16))
+    with _EXPORT_LOCK:
+        export_onnx(model, p['output'], shape, layout, dtype=torch.float16,
+                    use_dynamic_axes=p.get('use_dynamic_axes', False))
+
+
+def _op_reshape(ctx, p):
+    import onnx
+    model = onnx.ModelProto()
+    model.CopyFrom(ctx.store.onnx(p['input']))
+    reshape_onnx(model, p['height'], p['width'])
+    onnx.save(model, p['output'])
+    ctx.store.put(p['output'], model)
+
+
+@torch.no_grad()
+def _op_compare_fp16(ctx, p):
+    arch = p.get('model_arch', 'DFAOITNet')
+    model_fp32 = ctx.store.model(p['pth'], arch)
+    model_fp16 = copy.deepcopy(model_fp32).half()
+    shape = _input_shape(ARCHS[arch][1], p.get('dummy_h', 16), p.get('dummy_w', 16))
+    x = torch.randn(*shape, generator=torch.Generator().manual_seed(p.get('seed', 0)))
+    metrics = output_error_metrics(model_fp32(x), model_fp16(x.half()))
+    if p.get('report'):
+        with open(p['report'], 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=2)
+    return metrics
+
+
+# op -> (input artifact keys, output artifact keys, function)
+OPS = {
+    'create_default_ckpt': ((), ('output',), _op_create_default_ckpt),
+    'train':               ((), ('output',), _op_train),
+    'finetune':            (('init',), ('output',), _op_finetune),
+    'export':              (('pth',), ('output',), _op_export),
+    'export_fp16':         (('pth',), ('output', 'fp16_pth'), _op_export_fp16),
+    'reshape':             (('input',), ('output',), _op_reshape),
+    'compare_fp16':        (('pth',), ('report',), _op_compare_fp16),
+}
+
+
+class _Context:
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.store = ArtifactStore()
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        with self._lock:
+            self._hashes[key] = h.hexdigest()
+        return self._hashes[key]
+
+
+def load_spec(path):
+    """Read a JSON pipeline spec; relative artifact paths resolve against 'workdir' (default: the spec's folder)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    spec['workdir'] = os.path.abspath(os.path.join(base, spec.get('workdir', '.')))
+    return spec
+
+
+def _resolve(spec):
+    workdir = spec['workdir']
+    stages = {}
+    for raw in spec['stages']:
+        stage = dict(raw)
+        name, op = stage.get('name'), stage.get('op')
+        if not name or name in stages:
+            raise ValueError(f"Every stage needs a unique 'name' (got {name!r})")
+        if op not in OPS:
+            raise ValueError(f"Stage '{name}': unknown op {op!r}, expected one of {sorted(OPS)}")
+        in_keys, out_keys, _ = OPS[op]
+        for key in in_keys + out_keys:
+            if stage.get(key):
+                stage[key] = os.path.join(workdir, stage[key])
+        if 'output' in out_keys and not stage.get('output'):
+            raise ValueError(f"Stage '{name}' ({op}) needs an 'output'")
+        stage['inputs'] = [stage[k] for k in in_keys if stage.get(k)]
+        stage['outputs'] = [stage[k] for k in out_keys if stage.get(k)]
+        stages[name] = stage
+
+    producers = {}
+    for name, stage in stages.items():
+        for path in stage['outputs']:
+            if path in producers:
+                raise ValueError(f"'{path}' is produced by both '{producers[path]}' and '{name}'")
+            producers[path] = name
+    deps = {name: {producers[p] for p in stage['inputs'] if p in producers} for name, stage in stages.items()}
+
+    # cycle check (Kahn)
+    remaining = {n: set(d) for n, d in deps.items()}
+    while remaining:
+        free = [n for n, d in remaining.items() if not d]
+        if not free:
+            raise ValueError(f"Pipeline has a dependency cycle among {sorted(remaining)}")
+        for n in free:
+            del remaining[n]
+        for d in remaining.values():
+            d.difference_update(free)
+    return stages, deps
+
+
+def _fingerprint(ctx, stage):
+    params = {k: v for k, v in stage.items() if k not in ('inputs', 'outputs')}
+    h = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode())
+    for path in stage['inputs']:
+        h.update(path.encode())
+        h.update(ctx.file_hash(path).encode())
+    return h.hexdigest()
+
+
+def _run_stage(ctx, stage, previous, force):
+    for path in stage['inputs']:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Stage '{stage['name']}': missing input {path}")
+    fingerprint = _fingerprint(ctx, stage)
+
+    if not force and previous and previous.get('fingerprint') == fingerprint:
+        outputs = previous.get('outputs', {})
+        if all(os.path.exists(p) and outputs.get(p) == ctx.file_hash(p) for p in stage['outputs']):
+            return 'skipped', {'fingerprint': fingerprint, 'outputs': outputs, 'result': previous.get('result')}
+
+    for path in stage['outputs']:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    start = time.perf_counter()
+    result = OPS[stage['op']][2](ctx, stage)
+    elapsed = time.perf_counter() - start
+    outputs = {p: ctx.file_hash(p) for p in stage['outputs']}
+    return 'ran', {'fingerprint': fingerprint, 'outputs': outputs, 'result': result, 'seconds': elapsed}
+
+
+def run_pipeline(spec, jobs=None, force=False):
+    """
+    Run every stage of a spec in one process.
+    Stages are ordered by their artifacts (a stage depends on whoever produces its
+    inputs), independent stages run concurrently on `jobs` threads, and a stage
+    whose parameters and input contents are unchanged since the last successful
+    run (recorded in <workdir>/.pipeline_state.json) is skipped.
+    Returns {stage name: (status, info)} with status ran / skipped / failed / blocked.
+    """
+    stages, deps = _resolve(spec)
+    workdir = spec['workdir']
+    os.makedirs(workdir, exist_ok=True)
+    state_path = os.path.join(workdir, STATE_FILE)
+    state = {}
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+
+    ctx = _Context(workdir)
+    results = {}
+    pending = set(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        while pending or running:
+            for name in sorted(pending):
+                if deps[name] & {n for n, (st, _) in results.items() if st in ('failed', 'blocked')}:
+                    results[name] = ('blocked', {})
+                    pending.discard(name)
+                elif all(results.get(d, ('',))[0] in ('ran', 'skipped') for d in deps[name]):
+                    running[pool.submit(_run_stage, ctx, stages[name], state.get(name), force)] = name
+                    pending.discard(name)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    status, info = future.result()
+                    state[name] = {k: info.get(k) for k in ('fingerprint', 'outputs', 'result')}
+                except Exception as e:
+                    logger.exception(f"Stage '{name}' failed")
+                    status, info = 'failed', {'error': str(e)}
+                    state.pop(name, None)
+                results[name] = (status, info)
+                logger.info(f"[{status}] {name}")
+
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, default=str)
+    return results
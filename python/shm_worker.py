@@ -0,0 +1,328 @@
+import multiprocessing as mp
+import queue
+import time
+import logging
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+
+from inference import (load_reference_model, mlp_weights, numpy_weights, forward_into_torch,
+                       forward_into_numpy, load_onnx_session, forward_into_onnx, onnx_io_dtypes)
+from output_formats import FORMATS, QuantizedWriter, output_shape
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "numpy", "onnx")
+
+
+class SharedFrameRing:
+    """
+    Ring of paired frame slots in shared memory:
+      inputs : [slots, H, W, 10] float32
+      outputs: [slots, H, W, 3]  float32, or [slots, *output_shape(out_format, (H, W))]
+               in out_format's dtype (fp16 / rgb8 / rgba8 / rgb10a2, see output_formats)
+    Only slot indices travel through the queues; frame data is never pickled or copied.
+
+    Slot life cycle:
+      producer: acquire() -> write inputs[slot] in place -> submit(slot)
+      worker  : next_ready() -> read inputs[slot], write outputs[slot] -> mark_done(slot)
+      consumer: collect() -> read outputs[slot] -> release(slot)
+    With more than one worker, collect() returns slots in completion order.
+    """
+    def __init__(self, height, width, slots=4, in_channels=10, out_channels=3, ctx=None, out_format='fp32'):
+        ctx = ctx or mp.get_context()
+        self.height, self.width, self.slots = height, width, slots
+        self.out_format = out_format
+        self.out_dtype = FORMATS[out_format][0]
+        self.in_shape = (slots, height, width, in_channels)
+        if out_format == 'fp32':
+            self.out_shape = (slots, height, width, out_channels)
+        else:
+            self.out_shape = (slots,) + output_shape(out_format, (height, width))
+        itemsize = np.dtype(np.float32).itemsize
+
+        self._in_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.in_shape)) * itemsize)
+        self._out_shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(self.out_shape)) * np.dtype(self.out_dtype).itemsize)
+        self._owner = True
+
+        self._free = ctx.Queue()
+        self._ready = ctx.Queue()
+        self._done = ctx.Queue()
+        for i in range(slots):
+            self._free.put(i)
+
+        self._attach_views()
+
+    def _attach_views(self):
+        self.inputs = np.ndarray(self.in_shape, dtype=np.float32, buffer=self._in_shm.buf)
+        self.outputs = np.ndarray(self.out_shape, dtype=self.out_dtype, buffer=self._out_shm.buf)
+
+    # 跨进程传递时只传共享内存名字和队列
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_in_shm'] = self._in_shm.name
+        state['_out_shm'] = self._out_shm.name
+        state['_owner'] = False
+        del state['inputs'], state['outputs']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._in_shm = shared_memory.SharedMemory(name=state['_in_shm'])
+        self._out_shm = shared_memory.SharedMemory(name=state['_out_shm'])
+        self._attach_views()
+
+    # ---- producer ----
+    def acquire(self, timeout=None):
+        """Block until a free slot is available; returns (slot, writable [H,W,10] view)."""
+        slot = self._free.get(timeout=timeout)
+        return slot, self.inputs[slot]
+
+    def submit(self, slot):
+        self._ready.put(slot)
+
+    # ---- worker ----
+    def next_ready(self, timeout=None):
+        """Next slot with a complete input frame, or None when the worker should stop."""
+        return self._ready.get(timeout=timeout)
+
+    def mark_done(self, slot):
+        self._done.put(slot)
+
+    def stop_workers(self, num_workers=1):
+        for _ in range(num_workers):
+            self._ready.put(None)
+
+    # ---- consumer ----
+    def collect(self, timeout=None):
+        """Block until a slot has been processed; returns (slot, read-only output view)."""
+        slot = self._done.get(timeout=timeout)
+        view = self.outputs[slot]
+        view.flags.writeable = False
+        return slot, view
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def detach(self):
+        """Drop this process' mapping of the ring without destroying it."""
+        # views must be dropped before the mapping can be closed
+        self.inputs = self.outputs = None
+        self._in_shm.close()
+        self._out_shm.close()
+
+    def close(self):
+        """Detach, and free the shared memory if this is the process that created it."""
+        self.detach()
+        if self._owner:
+            self._in_shm.unlink()
+            self._out_shm.unlink()
+
+
+def make_frame_runner(backend, model_path=None):
+    """
+    Returns run(x, out) for one NHWC frame, x: [H,W,10] float32, out: [H,W,3] float32 or float16.
+    Every backend writes into out in place. run.out_dtype is the dtype the model produces
+    natively (float16 for fp16 ONNX exports); QuantizedWriter passes buffers of that dtype,
+    so the output is quantized without a float32 round trip.
+    """
+    if backend == "torch":
+        layers, sigmoid = mlp_weights(load_reference_model(model_path))
+
+        def run(x, out):
+            forward_into_torch(layers, sigmoid, torch.from_numpy(x), torch.from_numpy(out))
+        run.out_dtype = np.float32
+        return run
+
+    if backend == "numpy":
+        layers, sigmoid = numpy_weights(load_reference_model(model_path))
+
+        def run(x, out):
+            forward_into_numpy(layers, sigmoid, x, out)
+        run.out_dtype = np.float32
+        return run
+
+    if backend == "onnx":
+        if model_path is None:
+            raise ValueError("The onnx backend needs an exported NHWC .onnx model")
+        session = load_onnx_session(model_path)
+        in_shape = session.get_inputs()[0].shape
+        if len(in_shape) != 4 or in_shape[-1] != 10:
+            raise ValueError(f"Shared-memory frames are NHWC [1,H,W,10]; model input is {in_shape}")
+        in_dtype, out_dtype = onnx_io_dtypes(session)
+        buffers = {}
+
+        def buffer(name, shape, dtype):
+            buf = buffers.get(name)
+            if buf is None or buf.shape != shape:
+                buf = buffers[name] = np.empty(shape, dtype=dtype)
+            return buf
+
+        def run(x, out):
+            # fp16 exports: cast into / out of reusable buffers of the graph's element types
+            if x.dtype != in_dtype:
+                feed = buffer('x', x.shape, in_dtype)
+                np.copyto(feed, x, casting='same_kind')
+                x = feed
+            if out.dtype != out_dtype:
+                y = buffer('out', out.shape, out_dtype)
+                forward_into_onnx(session, x[None], y[None])
+                np.copyto(out, y, casting='same_kind')
+            else:
+                forward_into_onnx(session, x[None], out[None])
+        run.out_dtype = out_dtype
+        return run
+
+    raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+
+def inference_worker(ring, backend, model_path=None, num_threads=None):
+    """
+    Worker loop: process ready slots of the ring until a stop sentinel arrives.
+    Outputs are converted to ring.out_format in the final stage, written into the slot directly.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    run = make_frame_runner(backend, model_path)
+    writer = QuantizedWriter(ring.out_format)
+    # ONNX 模型的 H/W 可能是固定的，不分块
+    rows = ring.height if backend == "onnx" else None
+    try:
+        while True:
+            slot = ring.next_ready()
+            if slot is None:
+                break
+            writer.forward(run, ring.inputs[slot], ring.outputs[slot], rows)
+            ring.mark_done(slot)
+    finally:
+        ring.detach()
+
+
+class InferenceWorker:
+    """
+    Inference process(es) attached to a SharedFrameRing.
+
+        ring = SharedFrameRing(1080, 1920)
+        with InferenceWorker(ring, "torch", "default.pth"):
+            slot, frame = ring.acquire(); frame[...] = ...; ring.submit(slot)
+            slot, rgb = ring.collect(); ...; ring.release(slot)
+    """
+    def __init__(self, ring, backend="torch", model_path=None, num_workers=1, num_threads=None, ctx=None):
+        ctx = ctx or mp.get_context()
+        self.ring = ring
+        self.processes = [
+            ctx.Process(target=inference_worker, args=(ring, backend, model_path, num_threads), daemon=True)
+            for _ in range(num_workers)
+        ]
+
+    def start(self):
+        for p in self.processes:
+            p.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.ring.stop_workers(len(self.processes))
+        for p in self.processes:
+            p.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _pickle_worker(in_q, out_q, backend, model_path, num_threads, out_format):
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    run = make_frame_runner(backend, model_path)
+    writer = QuantizedWriter(out_format)
+    while True:
+        frame = in_q.get()
+        if frame is None:
+            break
+        out = np.empty(output_shape(out_format, frame.shape[:-1]), dtype=FORMATS[out_format][0])
+        writer.forward(run, frame, out, frame.shape[0] if backend == "onnx" else None)
+        out_q.put(out)
+
+
+def _bench_pickle(backend, model_path, height, width, frames, depth, num_threads, seed, out_format):
+    ctx = mp.get_context()
+    in_q, out_q = ctx.Queue(maxsize=depth), ctx.Queue()
+    proc = ctx.Process(target=_pickle_worker, args=(in_q, out_q, backend, model_path, num_threads, out_format),
+                       daemon=True)
+    proc.start()
+    rng = np.random.default_rng(seed)
+    shape = (height, width, 10)
+
+    # 预热：加载模型 + 第一次推理不计时
+    in_q.put(rng.random(shape, dtype=np.float32))
+    out_q.get()
+
+    start = time.perf_counter()
+    in_flight = 0
+    for _ in range(frames):
+        # a fresh array per frame: the queue's feeder thread pickles it later, so a
+        # reused buffer could be overwritten by the next frame before it is sent
+        in_q.put(rng.random(shape, dtype=np.float32))   # pickled + copied through a pipe
+        in_flight += 1
+        if in_flight >= depth:
+            out_q.get()
+            in_flight -= 1
+    for _ in range(in_flight):
+        out_q.get()
+    elapsed = time.perf_counter() - start
+
+    in_q.put(None)
+    proc.join()
+    return elapsed
+
+
+def _bench_shm(backend, model_path, height, width, frames, depth, num_threads, seed, out_format):
+    ring = SharedFrameRing(height, width, slots=depth, out_format=out_format)
+    rng = np.random.default_rng(seed)
+    try:
+        with InferenceWorker(ring, backend, model_path, num_threads=num_threads):
+            slot, frame = ring.acquire()
+            rng.random(out=frame, dtype=np.float32)
+            ring.submit(slot)
+            ring.release(ring.collect()[0])
+
+            start = time.perf_counter()
+            in_flight = 0
+            for _ in range(frames):
+                try:
+                    slot, frame = ring.acquire(timeout=0 if in_flight else None)
+                except queue.Empty:
+                    ring.release(ring.collect()[0])
+                    in_flight -= 1
+                    slot, frame = ring.acquire()
+                rng.random(out=frame, dtype=np.float32)   # producer writes in place
+                ring.submit(slot)
+                in_flight += 1
+            for _ in range(in_flight):
+                ring.release(ring.collect()[0])
+            elapsed = time.perf_counter() - start
+    finally:
+        ring.close()
+    return elapsed
+
+
+def benchmark_shm_vs_pickle(backend="torch", model_path=None, height=1080, width=1920,
+                            frames=20, depth=2, num_threads=None, seed=0, out_format="fp32"):
+    """
+    Push the same frame stream through a worker process twice:
+      pickle : frames/outputs sent through multiprocessing queues (serialized copies)
+      shm    : frames/outputs exchanged through SharedFrameRing slots
+    Both paths emit out_format outputs (see output_formats.FORMATS).
+    Returns a dict with seconds and frames/s for both.
+    """
+    results = {}
+    for name, fn in (("pickle", _bench_pickle), ("shm", _bench_shm)):
+        elapsed = fn(backend, model_path, height, width, frames, depth, num_threads, seed, out_format)
+        results[name] = {"seconds": elapsed, "fps": frames / elapsed}
+        logger.info(f"[{name}] {frames} frames in {elapsed:.3f}s ({frames / elapsed:.2f} fps)")
+    results["speedup"] = results["shm"]["fps"] / results["pickle"]["fps"]
+    return results
@@ -1,25 +1,41 @@
+import os
+import copy
+import numpy as np
 import torch
+import torch.multiprocessing as mp
 import torch.nn.functional as F
 import torch.optim as optim
-from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.data import Dataset
 from tqdm import tqdm
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def derive_seed(seed, index):
+    """Independent, reproducible 63-bit seed for sub-stream `index` of `seed` (shards, chunks, workers)."""
+    state = np.random.SeedSequence([seed, index]).generate_state(1, dtype=np.uint64)[0]
+    return int(state) & 0x7FFF_FFFF_FFFF_FFFF
+
+
 @torch.no_grad()
-def generate_consistency_data(reference_model, num_samples=20000, spatial=False, H=16, W=16):
+def generate_consistency_data(reference_model, num_samples=20000, spatial=False, H=16, W=16, seed=None):
     """
     生成一致性训练数据，固定 batch=1。
     - spatial=False: 产生输入 [1,10]，输出 [1,3]
     - spatial=True : 产生输入 [1,10,H,W]，输出 [1,3,H,W]
+    - seed: 给定时输入由独立的 CPU Generator 生成，结果可复现；None 时使用全局随机状态
     """
     device = next(reference_model.parameters()).device
     reference_model.eval()
+    generator = torch.Generator().manual_seed(seed) if seed is not None else None
 
     inputs, targets = [], []
     for _ in tqdm(range(num_samples)):
-        if spatial:
+        if generator is not None:
+            shape = (1, 10, H, W) if spatial else (1, 10)
+            inp = torch.rand(*shape, generator=generator).to(device)
+        elif spatial:
             inp = torch.rand(1, 10, H, W, device=device)
         else:
             inp = torch.rand(1, 10, device=device)
@@ -31,6 +47,144 @@ def generate_consistency_data(reference_model, num_samples=20000, spatial=False,
     return torch.stack(inputs), torch.stack(targets)
 
 
+@torch.no_grad()
+def generate_consistency_chunk(reference_model, num_samples, spatial=False, H=16, W=16, seed=0):
+    """
+    Batched, seeded generation of one chunk of consistency data.
+    - spatial=False: 输入 [n,10]，输出 [n,3]
+    - spatial=True : 输入 [n,10,H,W]，输出 [n,3,H,W]
+    The chunk depends only on (reference weights, num_samples, seed), not on which process runs it.
+    """
+    device = next(reference_model.parameters()).device
+    reference_model.eval()
+    shape = (num_samples, 10, H, W) if spatial else (num_samples, 10)
+    inp = torch.rand(*shape, generator=torch.Generator().manual_seed(seed))
+    out = reference_model(inp.to(device)).cpu()
+    return inp, out
+
+
+# ---- per-process state of the generation pool ----
+_POOL_STATE = {}
+
+
+def _pool_init(model, sink, spatial, H, W, seed, threads):
+    # 每个 worker 固定线程数，避免 N 个进程 × 全部核心的超额订阅
+    # (torch is already imported here, so OMP_NUM_THREADS would have no effect)
+    torch.set_num_threads(threads)
+    _POOL_STATE.update(model=model.eval(), sink=sink, spatial=spatial, H=H, W=W, seed=seed)
+
+
+def _pool_chunk(task):
+    index, start, n = task
+    st = _POOL_STATE
+    inp, out = generate_consistency_chunk(st['model'], n, st['spatial'], st['H'], st['W'],
+                                          seed=derive_seed(st['seed'], index))
+    sink = st['sink']
+    if isinstance(sink, str):
+        # directory of preallocated shard files (see data_cache.DatasetCache)
+        np.load(os.path.join(sink, f'inputs_{index:05d}.npy'), mmap_mode='r+')[:] = inp.numpy()
+        np.load(os.path.join(sink, f'targets_{index:05d}.npy'), mmap_mode='r+')[:] = out.numpy()
+    else:
+        inputs, targets = sink
+        inputs[start:start + n] = inp
+        targets[start:start + n] = out
+    return n
+
+
+def run_generation_pool(reference_model, num_samples, sink, spatial=False, H=16, W=16, seed=0,
+                        workers=None, chunk_size=4096, threads_per_worker=1):
+    """
+    Split num_samples into fixed-size chunks and generate them on a process pool.
+    Chunk i always uses derive_seed(seed, i) and the same thread count, so the
+    result is identical for any number of workers.
+      sink: (inputs, targets) shared-memory tensors, or a directory holding
+            preallocated inputs_XXXXX.npy / targets_XXXXX.npy (one per chunk)
+      workers: None = one per CPU, 0 = same chunks generated in this process
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    tasks = [(i, start, min(chunk_size, num_samples - start))
+             for i, start in enumerate(range(0, num_samples, chunk_size))]
+    model = copy.deepcopy(reference_model).cpu()
+
+    if workers == 0:
+        threads = torch.get_num_threads()
+        _pool_init(model, sink, spatial, H, W, seed, threads_per_worker)
+        try:
+            for task in tqdm(tasks):
+                _pool_chunk(task)
+        finally:
+            _POOL_STATE.clear()
+            torch.set_num_threads(threads)
+        return
+
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(min(workers, len(tasks)), initializer=_pool_init,
+                  initargs=(model, sink, spatial, H, W, seed, threads_per_worker)) as pool:
+        with tqdm(total=num_samples) as bar:
+            for n in pool.imap_unordered(_pool_chunk, tasks):
+                bar.update(n)
+
+
+def generate_consistency_data_parallel(reference_model, num_samples=20000, spatial=False, H=16, W=16,
+                                       seed=0, workers=None, chunk_size=4096, threads_per_worker=1):
+    """
+    Multi-process generate_consistency_data. Workers write straight into shared
+    output tensors; the result only depends on (seed, chunk_size), not on workers
+    (workers=0 generates the same chunks in this process).
+    Returns (inputs [N,10] or [N,10,H,W], targets [N,3] or [N,3,H,W]).
+    """
+    in_shape = (10, H, W) if spatial else (10,)
+    out_shape = (3, H, W) if spatial else (3,)
+    inputs = torch.empty(num_samples, *in_shape).share_memory_()
+    targets = torch.empty(num_samples, *out_shape).share_memory_()
+    run_generation_pool(reference_model, num_samples, (inputs, targets), spatial, H, W, seed,
+                        workers, chunk_size, threads_per_worker)
+    return inputs, targets
+
+
+def split_train_val(inputs, targets, train_ratio=0.8):
+    """前 train_ratio 作为训练集，其余作为验证集"""
+    train_size = int(train_ratio * len(inputs))
+    return (inputs[:train_size], targets[:train_size]), (inputs[train_size:], targets[train_size:])
+
+
+class TensorShards(Dataset):
+    """
+    In-memory (inputs, targets) with the shard interface of data_cache.ShardedConsistencyDataset:
+    iter_shards() yields views of shard_size samples (one shard when None), nothing is copied.
+    """
+    def __init__(self, inputs, targets, shard_size=None):
+        self.inputs, self.targets = inputs, targets
+        self.shard_size = shard_size or max(len(inputs), 1)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __getitem__(self, idx):
+        return self.inputs[idx], self.targets[idx]
+
+    def iter_shards(self):
+        for start in range(0, len(self), self.shard_size):
+            yield self.inputs[start:start + self.shard_size], self.targets[start:start + self.shard_size]
+
+    def view(self, start=0, stop=None):
+        return TensorShards(self.inputs[start:stop], self.targets[start:stop], self.shard_size)
+
+    def split(self, train_ratio=0.8):
+        """Same split as split_train_val, as two TensorShards."""
+        mid = int(train_ratio * len(self))
+        return self.view(0, mid), self.view(mid)
+
+    def tensors(self):
+        return self.inputs, self.targets
+
+
+def as_shard_tensor(a, device):
+    # memory-mapped shards are copied here, one shard at a time
+    return (a if torch.is_tensor(a) else torch.from_numpy(np.array(a))).to(device)
+
+
 def simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets,
                      best_path='best_consistency_model.pth', spatial=False):
     """
@@ -38,15 +192,20 @@ def simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets
     - 输入:  [10] 或 [10,H,W]
     - 输出:  [3]  或 [3,H,W]
     """
+    sharded_fine_tune(model, TensorShards(train_inputs, train_targets), TensorShards(val_inputs, val_targets),
+                      best_path=best_path, spatial=spatial)
+
+
+def sharded_fine_tune(model, train_set, val_set, best_path='best_consistency_model.pth', spatial=False):
+    """
+    simple_fine_tune over datasets with iter_shards() (data_cache.ShardedConsistencyDataset,
+    TensorShards): only one shard is resident at a time. Each epoch visits the shards in
+    random order and the samples of a shard in random order (batch=1); with a single shard
+    this is a plain shuffled pass.
+    """
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     model.to(device)
 
-    # 还原 batch=1 维度
-    train_inputs = train_inputs.unsqueeze(1).to(device)   # [N,1,...]
-    train_targets = train_targets.unsqueeze(1).to(device)
-    val_inputs = val_inputs.unsqueeze(1).to(device)
-    val_targets = val_targets.unsqueeze(1).to(device)
-
     config = {
         'lr': 1e-4,
         'epochs': 50,
@@ -56,36 +215,37 @@ def simple_fine_tune(model, train_inputs, train_targets, val_inputs, val_targets
     optimizer = optim.AdamW(model.parameters(), lr=config['lr'], weight_decay=1e-3)
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', factor=0.8, patience=5)
 
-    # DataLoader 在 batch=1 情况下只是打乱顺序
-    train_loader = DataLoader(TensorDataset(train_inputs, train_targets), shuffle=True)
-    val_loader = DataLoader(TensorDataset(val_inputs, val_targets), shuffle=False)
-
     best_val = float('inf')
     patience_counter = 0
 
     for epoch in range(config['epochs']):
         # ---- train ----
         model.train()
-        train_loss = 0
-        for data, target in train_loader:
-            data, target = data.squeeze(1), target.squeeze(1)  # 去掉 fake batch=1
-            optimizer.zero_grad()
-            out = model(data)
-            loss = F.mse_loss(out, target)
-            loss.backward()
-            optimizer.step()
-            train_loss += loss.item()
-        train_loss /= len(train_loader)
+        train_loss, seen = 0.0, 0
+        shards = list(train_set.iter_shards())
+        for s in torch.randperm(len(shards)).tolist():
+            inputs, targets = (as_shard_tensor(t, device) for t in shards[s])
+            for i in torch.randperm(len(inputs)).tolist():
+                data, target = inputs[i:i + 1], targets[i:i + 1]   # batch=1
+                optimizer.zero_grad()
+                out = model(data)
+                loss = F.mse_loss(out, target)
+                loss.backward()
+                optimizer.step()
+                train_loss += loss.item()
+            seen += len(inputs)
+        train_loss /= max(seen, 1)
 
         # ---- val ----
+        # 每个样本元素数相同，逐样本 MSE 的均值等于整片求和后除以总元素数
         model.eval()
-        val_loss = 0
+        val_sq, val_elems = 0.0, 0
         with torch.no_grad():
-            for data, target in val_loader:
-                data, target = data.squeeze(1), target.squeeze(1)
-                out = model(data)
-                val_loss += F.mse_loss(out, target).item()
-        val_loss /= len(val_loader)
+            for inputs, targets in val_set.iter_shards():
+                inputs, targets = as_shard_tensor(inputs, device), as_shard_tensor(targets, device)
+                val_sq += F.mse_loss(model(inputs), targets, reduction='sum').item()
+                val_elems += targets.numel()
+        val_loss = val_sq / max(val_elems, 1)
 
         scheduler.step(val_loss)
 
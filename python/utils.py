@@ -136,4 +136,127 @@ namespace DFAOIT
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(csharp_code)
     
-    logger.info(f"Consistent RGBA weights exported to {output_path}")
\ No newline at end of file
+    logger.info(f"Consistent RGBA weights exported to {output_path}")
+
+def model_config(state_dict):
+    """
+    Constructor arguments of the DFAOITNet-family model a checkpoint was saved from:
+    {'hidden1', 'hidden2'} plus 'rank1' / 'rank2' for factorized (DFAOITNetLowRank) layers.
+    """
+    config = {}
+    for i in (1, 2):
+        name = f'layer{i}'
+        if f'{name}.weight' in state_dict:
+            config[f'hidden{i}'] = state_dict[f'{name}.weight'].shape[0]
+        else:
+            config[f'hidden{i}'] = state_dict[f'{name}.up.weight'].shape[0]
+            config[f'rank{i}'] = state_dict[f'{name}.down.weight'].shape[0]
+    return config
+
+
+def hidden_sizes(state_dict):
+    """(hidden1, hidden2) of a DFAOITNet / DFAOITNetConv / DFAOITNetLowRank checkpoint."""
+    config = model_config(state_dict)
+    return config['hidden1'], config['hidden2']
+
+
+def adapt_state_dict(state_dict, model):
+    """
+    Make a DFAOITNet (Linear, [out,in]) checkpoint loadable by DFAOITNetConv (1x1 Conv, [out,in,1,1])
+    and vice versa. Factorized layers (layerX.down / layerX.up) are multiplied back into a dense
+    weight when the target model has a plain layer. Returns a new dict; tensors that already
+    match are passed through.
+    """
+    target = model.state_dict()
+    adapted = dict(state_dict)
+    for i in (1, 2, 3):
+        name = f'layer{i}'
+        if f'{name}.up.weight' in state_dict and f'{name}.weight' in target:
+            adapted[f'{name}.weight'] = state_dict[f'{name}.up.weight'] @ state_dict[f'{name}.down.weight']
+            adapted[f'{name}.bias'] = state_dict[f'{name}.up.bias']
+            for part in ('up.weight', 'up.bias', 'down.weight'):
+                del adapted[f'{name}.{part}']
+    state_dict = dict(adapted)
+    for name, t in state_dict.items():
+        if name not in target or t.shape == target[name].shape:
+            continue
+        if t.dim() == 2 and target[name].dim() == 4:
+            adapted[name] = t[..., None, None]
+        elif t.dim() == 4 and target[name].dim() == 2:
+            adapted[name] = t.flatten(1)
+    return adapted
+
+
+def onnx_dynamic_axes(layout):
+    """dynamic_axes for torch.onnx.export: N/H/W dynamic, channels fixed."""
+    if layout == 'NCHW':
+        axes = {0: 'N', 2: 'H', 3: 'W'}
+    else:
+        axes = {0: 'N', 1: 'H', 2: 'W'}
+    return {'input': axes, 'output': axes}
+
+
+def export_onnx(model, output, input_shape, layout='NHWC', dtype=torch.float32,
+                use_dynamic_axes=False, opset_version=11):
+    """Export a DFAOIT model with the tool's naming (input/output) and settings."""
+    device = next(model.parameters()).device
+    dummy_input = torch.randn(*input_shape, device=device, dtype=dtype)
+    torch.onnx.export(
+        model,
+        dummy_input,
+        output,
+        opset_version=opset_version,
+        input_names=['input'],
+        output_names=['output'],
+        dynamic_axes=onnx_dynamic_axes(layout) if use_dynamic_axes else None,
+        do_constant_folding=True
+    )
+    return output
+
+
+def reshape_onnx(model, height, width):
+    """
+    Fix the spatial dims of an NCHW ONNX model in place.
+      input:  [1, 10, H, W]
+      output: [1,  3, H, W]
+    model: onnx.ModelProto. Returns the same object.
+    """
+    from onnx import TensorShapeProto
+
+    def set_dims(tensor, channels):
+        dims = tensor.type.tensor_type.shape.dim
+        dims.clear()
+        dims.extend([
+            TensorShapeProto.Dimension(dim_value=1),         # N
+            TensorShapeProto.Dimension(dim_value=channels),  # C
+            TensorShapeProto.Dimension(dim_value=height),    # H
+            TensorShapeProto.Dimension(dim_value=width),     # W
+        ])
+
+    set_dims(model.graph.input[0], 10)
+    set_dims(model.graph.output[0], 3)
+
+    # 如果有多个 input，一并改成 NCHW 的 H、W
+    for t in model.graph.input:
+        shape = t.type.tensor_type.shape
+        if len(shape.dim) == 4:
+            shape.dim[2].dim_value = height
+            shape.dim[3].dim_value = width
+    return model
+
+
+def output_error_metrics(reference, test, peak=1.0):
+    """MAE / max abs / MSE / PSNR between two outputs (tensors or arrays), computed in fp32."""
+    import math
+    ref = reference.detach().cpu().float().numpy() if torch.is_tensor(reference) else np.asarray(reference, np.float32)
+    out = test.detach().cpu().float().numpy() if torch.is_tensor(test) else np.asarray(test, np.float32)
+    if ref.shape != out.shape:
+        raise ValueError(f"Shape mismatch: {ref.shape} vs {out.shape}")
+    diff = ref.astype(np.float32) - out.astype(np.float32)
+    mse = float(np.mean(diff ** 2))
+    return {
+        'mae': float(np.mean(np.abs(diff))),
+        'max_abs': float(np.max(np.abs(diff))),
+        'mse': mse,
+        'psnr': 10.0 * math.log10((peak ** 2) / (mse + 1e-12)),
+    }
@@ -0,0 +1,191 @@
+import os
+import glob
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from inference import load_reference_model, load_onnx_session, mlp_weights, forward_into_torch
+
+logger = logging.getLogger(__name__)
+
+_ELEM_TYPES = {1: np.float32, 10: np.float16}
+
+# default max abs error allowed per precision
+DEFAULT_TOLERANCE = {'fp32': 1e-4, 'fp16': 2e-2}
+
+
+def inspect_onnx(path):
+    """
+    What the parity check needs to know about an exported model, read from its graph:
+      layout  : 'NHWC' [N,H,W,10], 'NCHW' [N,10,H,W] or 'flat' [N,10]
+      dtype   : np.float32 / np.float16 input
+      batch, height, width : fixed dims, None where dynamic
+      sigmoid : the graph ends in a Sigmoid (the 'sig' variants)
+    """
+    import onnx
+
+    model = onnx.load(path, load_external_data=False)
+    initializers = {init.name for init in model.graph.initializer}
+    inp = next(i for i in model.graph.input if i.name not in initializers)
+    tensor_type = inp.type.tensor_type
+    dims = [d.dim_value if d.HasField('dim_value') and d.dim_value > 0 else None for d in tensor_type.shape.dim]
+    if tensor_type.elem_type not in _ELEM_TYPES:
+        raise ValueError(f"Unsupported input element type {tensor_type.elem_type}")
+
+    if len(dims) == 4 and dims[1] == 10:
+        layout, (height, width) = 'NCHW', dims[2:4]
+    elif len(dims) == 4 and dims[3] == 10:
+        layout, (height, width) = 'NHWC', dims[1:3]
+    elif len(dims) == 2 and dims[1] == 10:
+        layout, height, width = 'flat', None, None
+    else:
+        raise ValueError(f"Unrecognized input shape {dims}")
+
+    dtype = _ELEM_TYPES[tensor_type.elem_type]
+    return {
+        'input': inp.name,
+        'layout': layout,
+        'dtype': dtype,
+        'precision': 'fp16' if dtype == np.float16 else 'fp32',
+        'batch': dims[0],
+        'height': height,
+        'width': width,
+        'sigmoid': any(node.op_type == 'Sigmoid' for node in model.graph.node),
+    }
+
+
+class InputStream:
+    """
+    Deterministic NHWC fp32 input batches: batch i of shape (n, h, w) is the same for every
+    model, so reference outputs can be shared. Real frames ([M,H,W,10]) are used for the
+    shapes they fit; other shapes fall back to seeded random data.
+    """
+    def __init__(self, seed=0, frames=None):
+        self.seed = seed
+        self.frames = None if frames is None else np.asarray(frames, dtype=np.float32)
+        if self.frames is not None and self.frames.ndim == 3:
+            self.frames = self.frames[None]
+
+    def is_real(self, h, w):
+        return self.frames is not None and self.frames.shape[1:3] == (h, w)
+
+    def batch(self, n, h, w, i):
+        if self.is_real(h, w):
+            idx = [(i * n + k) % len(self.frames) for k in range(n)]
+            return np.ascontiguousarray(self.frames[idx])
+        return np.random.default_rng([self.seed, n, h, w, i]).random((n, h, w, 10), dtype=np.float32)
+
+
+class ReferenceOutputs:
+    """PyTorch logits (before any sigmoid) per input batch, computed once and shared across models."""
+    def __init__(self, model):
+        self.layers, _ = mlp_weights(model)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, x):
+        """
+        (logits [n,h,w,3] fp32, ms) for input batch `key`. ms is the time of the pass that
+        computed the entry, also on cache hits, so every model reports the same reference time.
+        """
+        # torch already uses every core, so reference passes are serialized; ORT runs outside the lock
+        with self._lock:
+            if key not in self._cache:
+                out = np.empty(x.shape[:-1] + (3,), dtype=np.float32)
+                start = time.perf_counter()
+                forward_into_torch(self.layers, False, torch.from_numpy(x), torch.from_numpy(out))
+                self._cache[key] = (out, (time.perf_counter() - start) * 1000.0)
+            return self._cache[key]
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def verify_model(path, reference, stream, batches=8, batch_size=1, height=64, width=64, tolerance=None):
+    """
+    Run `batches` input batches through the ONNX model and the PyTorch reference.
+    Dynamic dims take batch_size / height / width; fixed dims come from the graph.
+    Returns a result dict with status 'pass', 'fail' (max abs error above the precision's
+    tolerance) or 'error' (the model could not be inspected / loaded / run).
+    """
+    tolerance = dict(DEFAULT_TOLERANCE, **(tolerance or {}))
+    result = {'model': os.path.basename(path), 'path': path}
+    try:
+        info = inspect_onnx(path)
+        result.update({k: info[k] for k in ('layout', 'precision', 'sigmoid')})
+        if info['layout'] == 'flat':
+            n, h, w = 1, 1, info['batch'] or batch_size * height * width
+        else:
+            n, h, w = info['batch'] or batch_size, info['height'] or height, info['width'] or width
+        result['shape'] = (n, h, w)
+        result['fixed'] = info['height'] is not None or (info['layout'] == 'flat' and info['batch'] is not None)
+        result['real_inputs'] = stream.is_real(h, w)
+
+        session = load_onnx_session(path)
+        abs_sum, count, max_abs, torch_ms, ort_ms = 0.0, 0, 0.0, 0.0, 0.0
+        for i in range(batches):
+            x = stream.batch(n, h, w, i)
+            logits, ms = reference.get((n, h, w, i), x)
+            torch_ms += ms
+            expected = _sigmoid(logits) if info['sigmoid'] else logits
+
+            if info['layout'] == 'NCHW':
+                feed = x.transpose(0, 3, 1, 2)
+            elif info['layout'] == 'flat':
+                feed = x.reshape(-1, 10)
+            else:
+                feed = x
+            feed = np.ascontiguousarray(feed, dtype=info['dtype'])
+            start = time.perf_counter()
+            y = session.run(None, {info['input']: feed})[0]
+            ort_ms += (time.perf_counter() - start) * 1000.0
+
+            y = y.astype(np.float32)
+            if info['layout'] == 'NCHW':
+                y = y.transpose(0, 2, 3, 1)
+            y = y.reshape(expected.shape)
+            diff = np.abs(y - expected)
+            abs_sum += float(diff.sum(dtype=np.float64))
+            count += diff.size
+            max_abs = max(max_abs, float(diff.max()))
+
+        result.update({
+            'batches': batches,
+            'mae': abs_sum / count,
+            'max_abs': max_abs,
+            'tolerance': tolerance[info['precision']],
+            'torch_ms': torch_ms / batches,
+            'ort_ms': ort_ms / batches,
+        })
+        result['status'] = 'pass' if max_abs <= result['tolerance'] else 'fail'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    logger.info(f"{result['model']}: {result['status']}")
+    return result
+
+
+def verify_directory(pth, onnx_dir, pattern='*.onnx', jobs=None, seed=0, frames=None, **kwargs):
+    """
+    verify_model for every ONNX file in onnx_dir against the weights in `pth`
+    (None = shader weights), `jobs` models at a time. Results are sorted by file name.
+    """
+    paths = sorted(glob.glob(os.path.join(onnx_dir, pattern)))
+    reference = ReferenceOutputs(load_reference_model(pth))
+    stream = InputStream(seed, frames)
+    with ThreadPoolExecutor(max_workers=jobs or min(4, os.cpu_count() or 1)) as pool:
+        return list(pool.map(lambda p: verify_model(p, reference, stream, **kwargs), paths))
+
+
+def exit_code(results):
+    """0: every model passed, 1: a model exceeded its tolerance, 2: a model errored or nothing was verified."""
+    if not results or any(r['status'] == 'error' for r in results):
+        return 2
+    if any(r['status'] == 'fail' for r in results):
+        return 1
+    return 0